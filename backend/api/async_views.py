@@ -0,0 +1,272 @@
+"""Асинхронные представления для чтения под ASGI.
+
+GET-запросы к спискам и деталям рецептов, спискам тегов, ингредиентов
+и подписок обрабатываются асинхронным ORM, поэтому один воркер
+uvicorn обслуживает много одновременных запросов. Логика запросов,
+фильтров и сериализации берётся из синхронных вьюсетов api.views.
+
+Остальные методы, а также запросы браузерной версии API передаются
+синхронному представлению из роутера в отдельном потоке.
+Подключаются в api.urls при SERVER_MODE=asgi.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from foodgram.middleware import measure_render
+from recipes.models import Ingredient, Recipe, Tag
+
+from .authentication import CachedTokenAuthentication
+from .cache import aget_recipe_fragments
+from .conditional import aconditional_response, acatalogue_response
+from .filters import IngredientFilter
+from .ingredient_index import aget_ingredient_index
+from .serializers import (FollowListSerializer, IngredientSerializer,
+                          RecipeListSerializer, TagSerializer)
+from .utils import aget_versions
+
+
+def render(data, status=200):
+    with measure_render():
+        content = JSONRenderer().render(data)
+    return HttpResponse(
+        content,
+        status=status,
+        content_type='application/json'
+    )
+
+
+def error_response(exc):
+    """Ответ на APIException в формате обработчика ошибок DRF."""
+    if isinstance(exc.detail, (list, dict)):
+        data = exc.detail
+    else:
+        data = {'detail': exc.detail}
+    response = render(data, exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated,
+                        exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = CachedTokenAuthentication.keyword
+    return response
+
+
+class AsyncReadView(View):
+    """GET обрабатывается асинхронно, остальное — sync_view в потоке.
+
+    sync_view — представление вьюсета из роутера. Экземпляр того же
+    вьюсета доступен в read() как self.viewset: через него
+    используются queryset, фильтры и сериализация синхронной версии.
+    """
+
+    sync_view = None
+    http_method_names = (
+        'get', 'post', 'put', 'patch', 'delete', 'head', 'options'
+    )
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Как и у представлений DRF: CSRF проверяет SessionAuthentication.
+        view.csrf_exempt = True
+        return view
+
+    async def get(self, request, *args, **kwargs):
+        if self.wants_browsable_api(request):
+            return await self.delegate(request, *args, **kwargs)
+        drf_request = Request(request)
+        try:
+            credentials = await CachedTokenAuthentication().aauthenticate(
+                request
+            )
+            drf_request.user, drf_request.auth = credentials or (
+                AnonymousUser(), None
+            )
+            self.viewset = self.get_viewset(drf_request, args, kwargs)
+            response = await self.read(drf_request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            response = error_response(exc)
+        response['Allow'] = ', '.join(self.get_allowed_methods())
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    async def delegate(self, request, *args, **kwargs):
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    post = put = patch = delete = options = delegate
+
+    @staticmethod
+    def wants_browsable_api(request):
+        return (
+            'format' in request.GET
+            or 'text/html' in request.headers.get('Accept', '')
+        )
+
+    def get_viewset(self, request, args, kwargs):
+        viewset = self.sync_view.cls(**self.sync_view.initkwargs)
+        viewset.action_map = self.sync_view.actions
+        viewset.action = self.sync_view.actions['get']
+        viewset.request = request
+        viewset.args = args
+        viewset.kwargs = kwargs
+        viewset.format_kwarg = None
+        return viewset
+
+    def get_allowed_methods(self):
+        actions = self.sync_view.actions
+        return [
+            method.upper() for method in self.http_method_names
+            if method in actions or method == 'options'
+            or method == 'head' and 'get' in actions
+        ]
+
+    async def read(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    async def paginate(self, queryset):
+        viewset = self.viewset
+        viewset._paginator = viewset.pagination_class()
+        return await viewset.paginator.apaginate_queryset(
+            queryset, viewset.request, view=viewset
+        )
+
+    def paginated_response(self, data):
+        return render(self.viewset.get_paginated_response(data).data)
+
+
+class RecipeListView(AsyncReadView):
+
+    async def read(self, request):
+        viewset = self.viewset
+        coverage = await sync_to_async(viewset.get_coverage)()
+        if coverage is not None:
+            versions = await aget_versions(
+                *viewset.get_sequence_version_keys()
+            )
+            return await aconditional_response(
+                request,
+                viewset.get_list_etag(versions),
+                lambda: self.get_sequence_response(coverage)
+            )
+        # FilterSet проверяет теги и автора запросами к базе, поэтому
+        # фильтрация выполняется в потоке; сам queryset ленивый.
+        queryset = await sync_to_async(viewset.filter_queryset)(
+            Recipe.objects.all()
+        )
+        versions = await aget_versions(
+            *viewset.get_list_version_keys(queryset)
+        )
+        return await aconditional_response(
+            request,
+            viewset.get_list_etag(versions),
+            lambda: self.get_list_response(
+                viewset.annotate_user_flags(queryset)
+            )
+        )
+
+    async def get_list_response(self, queryset):
+        viewset = self.viewset
+        page = await self.paginate(viewset.get_page_values(queryset))
+        fragments = await aget_recipe_fragments(
+            {row['id']: row['updated_at'] for row in page},
+            viewset.get_fragment_queryset()
+        )
+        return self.paginated_response(
+            viewset.personalize_page(page, fragments)
+        )
+
+    async def get_sequence_response(self, sequence):
+        viewset = self.viewset
+        # Срез RecipeCoverage читает число ингредиентов синхронно.
+        page = await sync_to_async(viewset.paginate_queryset)(sequence)
+        page = viewset.merge_sequence_page(page, [
+            row async for row in viewset.get_sequence_page_values(page)
+        ])
+        fragments = await aget_recipe_fragments(
+            {row['id']: row['updated_at'] for row in page},
+            viewset.get_fragment_queryset()
+        )
+        return self.paginated_response(
+            viewset.personalize_page(page, fragments)
+        )
+
+
+class RecipeDetailView(AsyncReadView):
+
+    async def read(self, request, pk):
+        state = await self.viewset.get_detail_state(pk).afirst()
+        if state is None:
+            raise exceptions.NotFound()
+        return await aconditional_response(
+            request,
+            self.viewset.get_detail_etag(pk, *state),
+            lambda: self.get_detail_response(request, pk)
+        )
+
+    async def get_detail_response(self, request, pk):
+        recipe = await self.viewset.get_queryset().filter(pk=pk).afirst()
+        if recipe is None:
+            raise exceptions.NotFound()
+        return render(
+            RecipeListSerializer(recipe, context={'request': request}).data
+        )
+
+
+class TagListView(AsyncReadView):
+
+    async def read(self, request):
+        return await acatalogue_response(request, 'tags', self.load)
+
+    @staticmethod
+    async def load():
+        return TagSerializer(
+            [tag async for tag in Tag.objects.all()], many=True
+        ).data
+
+
+class IngredientListView(AsyncReadView):
+
+    async def read(self, request):
+        # Те же варианты, что в IngredientViewSet.list.
+        name = request.query_params.get('name')
+        if name is not None:
+            return render((await aget_ingredient_index()).search(name))
+        if any(param in request.query_params
+               for param in IngredientFilter.base_filters):
+            filterset = IngredientFilter(
+                request.query_params,
+                queryset=Ingredient.objects.all(),
+                request=request
+            )
+            if not filterset.is_valid():
+                raise exceptions.ValidationError(filterset.errors)
+            return render(IngredientSerializer(
+                [item async for item in filterset.qs], many=True
+            ).data)
+        return await acatalogue_response(request, 'ingredients', self.load)
+
+    @staticmethod
+    async def load():
+        return IngredientSerializer(
+            [item async for item in Ingredient.objects.all()], many=True
+        ).data
+
+
+class SubscriptionsView(AsyncReadView):
+
+    async def read(self, request):
+        if request.user.is_anonymous:
+            raise exceptions.NotAuthenticated()
+        viewset = self.viewset
+        recipes_limit = viewset.get_recipes_limit(request)
+        # Превью рецептов загружаются prefetch_related вместе со страницей.
+        page = await self.paginate(
+            viewset.get_subscriptions_queryset(request.user, recipes_limit)
+        )
+        return self.paginated_response(FollowListSerializer(
+            page, many=True,
+            context={'request': request, 'recipes_limit': recipes_limit}
+        ).data)
@@ -0,0 +1,189 @@
+import copy
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import (TokenAuthentication,
+                                           get_authorization_header)
+
+from .utils import TTLCache
+
+_worker_cache = TTLCache(
+    maxsize=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL
+)
+
+
+# Значение в общем кэше для отозванного токена. Пока оно лежит,
+# пользователь по токену не кэшируется заново: запрос, прочитавший
+# токен из базы до отзыва, не вернёт его в кэш.
+REVOKED = 'revoked'
+REVOKED_TIMEOUT = 60
+
+
+def token_cache_key(key):
+    # В общий кэш попадает хэш токена, а не сам токен.
+    return f'token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def get_shared_cache():
+    if settings.TOKEN_CACHE_ALIAS is None:
+        return None
+    return caches[settings.TOKEN_CACHE_ALIAS]
+
+
+def dump_credentials(credentials):
+    """Запись для общего кэша: поля пользователя без пароля и дата
+    создания токена. Ключ токена в запись не попадает."""
+    user, token = credentials
+    return {
+        'user': {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields
+            if field.name != 'password'
+        },
+        'created': token.created,
+    }
+
+
+def load_credentials(key, cached, token_model):
+    """Пользователь и токен из записи dump_credentials().
+
+    Пароль остаётся отложенным полем и читается из базы, только если
+    к нему обратятся.
+    """
+    user_model = token_model._meta.get_field('user').related_model
+    fields = cached['user']
+    user = user_model.from_db(
+        token_model.objects.db, list(fields), list(fields.values())
+    )
+    token = token_model.from_db(
+        token_model.objects.db,
+        ['key', 'user_id', 'created'],
+        [key, user.pk, cached['created']]
+    )
+    token.user = user
+    return user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который кэширует пользователя по ключу токена.
+
+    Если задан общий кэш TOKEN_CACHE_ALIAS, ищет только в нём: отзыв
+    токена сразу виден всем воркерам. В общий кэш попадают поля
+    пользователя без хэша пароля (см. dump_credentials). Без общего
+    кэша ищет в памяти воркера (при TOKEN_CACHE_TTL > 0), и другие
+    воркеры видят отзыв не позже чем через TOKEN_CACHE_TTL. Неудачные
+    попытки не кэшируются.
+    """
+
+    def authenticate_credentials(self, key):
+        shared = get_shared_cache()
+        if shared is not None:
+            cache_key = token_cache_key(key)
+            cached = shared.get(cache_key)
+            if cached is None or cached == REVOKED:
+                credentials = super().authenticate_credentials(key)
+                if cached is None:
+                    # add, а не set: не перезаписывает отметку отзыва,
+                    # поставленную после чтения из базы.
+                    shared.add(cache_key, dump_credentials(credentials))
+                return credentials
+            return load_credentials(key, cached, self.get_model())
+        elif settings.TOKEN_CACHE_TTL > 0:
+            cached = _worker_cache.get(key)
+            if cached is None:
+                cached = super().authenticate_credentials(key)
+                _worker_cache.set(key, cached)
+        else:
+            cached = super().authenticate_credentials(key)
+        return self.copy_credentials(cached)
+
+    async def aauthenticate(self, request):
+        """authenticate() для асинхронных представлений.
+
+        Разбирает заголовок так же, как TokenAuthentication, кэши
+        и запрос Token + User выполняются асинхронно.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. No credentials provided.')
+            )
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_(
+                'Invalid token header. '
+                'Token string should not contain spaces.'
+            ))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_(
+                'Invalid token header. '
+                'Token string should not contain invalid characters.'
+            ))
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        shared = get_shared_cache()
+        if shared is not None:
+            cache_key = token_cache_key(key)
+            cached = await shared.aget(cache_key)
+            if cached is None or cached == REVOKED:
+                credentials = await self.aload_credentials(key)
+                if cached is None:
+                    await shared.aadd(
+                        cache_key, dump_credentials(credentials)
+                    )
+                return credentials
+            return load_credentials(key, cached, self.get_model())
+        elif settings.TOKEN_CACHE_TTL > 0:
+            cached = _worker_cache.get(key)
+            if cached is None:
+                cached = await self.aload_credentials(key)
+                _worker_cache.set(key, cached)
+        else:
+            cached = await self.aload_credentials(key)
+        return self.copy_credentials(cached)
+
+    async def aload_credentials(self, key):
+        """Запрос Token + User из authenticate_credentials() DRF."""
+        model = self.get_model()
+        token = await model.objects.select_related('user').filter(
+            key=key
+        ).afirst()
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return token.user, token
+
+    @staticmethod
+    def copy_credentials(cached):
+        # Запрос получает свою копию, чтобы изменения request.user
+        # не попадали в кэш.
+        user, token = cached
+        return copy.copy(user), token
+
+
+def invalidate_tokens(keys):
+    """Сбрасывает токены в кэшах после выхода, смены пароля и т.п.
+
+    В общем кэше вместо записей ставится отметка отзыва. Память других
+    воркеров (без общего кэша) очищается по истечении TOKEN_CACHE_TTL.
+    """
+    keys = list(keys)
+    for key in keys:
+        _worker_cache.delete(key)
+    shared = get_shared_cache()
+    if shared is not None and keys:
+        shared.set_many(
+            {token_cache_key(key): REVOKED for key in keys},
+            timeout=REVOKED_TIMEOUT
+        )
@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from recipes.models import Recipe
+
+from .serializers import RecipeFragmentSerializer
+from .utils import aget_version, bump_version, get_version
+
+# Меняется вместе с форматом RecipeFragmentSerializer,
+# чтобы старые записи кэша не попадали в ответы.
+RECIPE_CACHE_VERSION = 1
+
+
+def recipe_cache_key(recipe_id, updated_at):
+    # updated_at меняется при любом изменении общей части рецепта,
+    # поэтому устаревшая запись не может попасть под новый ключ.
+    return f'recipe:{recipe_id}:{updated_at.timestamp():.6f}'
+
+
+def serialize_fragments(recipes, versions):
+    """{id: общая часть рецепта} и записи для кэша по этим рецептам.
+
+    Запись сохраняется под updated_at, прочитанным вместе со страницей.
+    Если рецепт успел измениться, свежие данные попадут под старый
+    ключ, а следующий запрос с новым updated_at их не найдёт.
+    """
+    fresh = {
+        fragment['id']: fragment
+        for fragment in RecipeFragmentSerializer(recipes, many=True).data
+    }
+    entries = {
+        recipe_cache_key(recipe_id, versions[recipe_id]): fragment
+        for recipe_id, fragment in fresh.items()
+    }
+    return fresh, entries
+
+
+def get_recipe_fragments(versions, queryset):
+    """Возвращает {id: общая часть рецепта} по {id: updated_at}.
+
+    Отсутствующие в кэше рецепты загружаются одним запросом из queryset,
+    сериализуются RecipeFragmentSerializer и сохраняются в кэш.
+    """
+    keys = {
+        recipe_cache_key(recipe_id, updated_at): recipe_id
+        for recipe_id, updated_at in versions.items()
+    }
+    cached = cache.get_many(keys, version=RECIPE_CACHE_VERSION)
+    fragments = {keys[key]: fragment for key, fragment in cached.items()}
+    missing = [
+        recipe_id for recipe_id in keys.values()
+        if recipe_id not in fragments
+    ]
+    if missing:
+        fresh, entries = serialize_fragments(
+            queryset.filter(id__in=missing), versions
+        )
+        cache.set_many(
+            entries,
+            timeout=settings.RECIPE_CACHE_TIMEOUT,
+            version=RECIPE_CACHE_VERSION
+        )
+        fragments.update(fresh)
+    return fragments
+
+
+async def aget_recipe_fragments(versions, queryset):
+    """get_recipe_fragments() для асинхронных представлений."""
+    keys = {
+        recipe_cache_key(recipe_id, updated_at): recipe_id
+        for recipe_id, updated_at in versions.items()
+    }
+    cached = await cache.aget_many(keys, version=RECIPE_CACHE_VERSION)
+    fragments = {keys[key]: fragment for key, fragment in cached.items()}
+    missing = [
+        recipe_id for recipe_id in keys.values()
+        if recipe_id not in fragments
+    ]
+    if missing:
+        fresh, entries = serialize_fragments([
+            recipe async for recipe in queryset.filter(id__in=missing)
+        ], versions)
+        await cache.aset_many(
+            entries,
+            timeout=settings.RECIPE_CACHE_TIMEOUT,
+            version=RECIPE_CACHE_VERSION
+        )
+        fragments.update(fresh)
+    return fragments
+
+
+def catalogue_version_key(name):
+    return f'catalogue:{name}:version'
+
+
+def get_catalogue_version(name):
+    """Версия справочника, см. get_version."""
+    return get_version(catalogue_version_key(name))
+
+
+async def aget_catalogue_version(name):
+    return await aget_version(catalogue_version_key(name))
+
+
+def bump_catalogue_version(name):
+    bump_version(catalogue_version_key(name))
+
+
+def touch_recipes(recipe_ids):
+    """Обновляет updated_at рецептов, представление которых изменилось
+    без сохранения самого рецепта (автор, теги, ингредиенты)."""
+    Recipe.objects.filter(id__in=recipe_ids).update(updated_at=timezone.now())
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import threading
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from .cache import aget_catalogue_version, get_catalogue_version
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CatalogueSnapshot:
+    """Справочник, сериализованный в JSON один раз на версию.
+
+    Хранит тело ответа, заранее сжатые варианты и валидаторы
+    для условных запросов.
+    """
+
+    def __init__(self, data, version):
+        self.version = version
+        self.body = JSONRenderer().render(data)
+        self.etag = f'W/"{hashlib.md5(self.body).hexdigest()}"'
+        _, changed_at = version
+        # Справочник, который ещё не менялся, отдаётся без Last-Modified.
+        self.last_modified = (
+            int(changed_at.timestamp()) if changed_at is not None else None
+        )
+        self.encoded = {'gzip': gzip.compress(self.body)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body)
+
+    def encoding_for(self, request):
+        """Лучшее из поддерживаемых клиентом сжатий или None."""
+        accepted = set()
+        for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            coding, _, params = part.partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00'):
+                accepted.add(coding.strip())
+        for coding in ('br', 'gzip'):
+            if coding in self.encoded and coding in accepted:
+                return coding
+        return None
+
+    def response(self, request):
+        response = get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified
+        )
+        if response is None:
+            coding = self.encoding_for(request)
+            response = HttpResponse(
+                self.encoded[coding] if coding else self.body,
+                content_type='application/json'
+            )
+            if coding:
+                response['Content-Encoding'] = coding
+        response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.last_modified)
+        # Клиент хранит ответ, но каждый раз сверяет его с сервером.
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+def make_etag(*parts):
+    """Слабый ETag из значений, от которых зависит ответ."""
+    return f'W/"{hashlib.md5(repr(parts).encode()).hexdigest()}"'
+
+
+def conditional_response(request, etag, render):
+    """304, если у клиента актуальная версия, иначе ответ render().
+
+    Тело ответа строится, только когда ETag не совпал.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render()
+    return set_private_validators(response, etag)
+
+
+async def aconditional_response(request, etag, render):
+    """conditional_response() с асинхронной функцией render."""
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = await render()
+    return set_private_validators(response, etag)
+
+
+def set_private_validators(response, etag):
+    response['ETag'] = etag
+    # Ответ персональный: хранится только у клиента и сверяется
+    # с сервером при каждом запросе.
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def catalogue_response(request, name, load):
+    """Ответ со справочником name из снимка воркера.
+
+    load() возвращает данные для сериализации и вызывается, только
+    когда версия справочника (см. api.cache) изменилась.
+    """
+    version = get_catalogue_version(name)
+    snapshot = _snapshots.get(name)
+    if snapshot is None or snapshot.version != version:
+        with _lock:
+            snapshot = _snapshots.get(name)
+            if snapshot is None or snapshot.version != version:
+                snapshot = CatalogueSnapshot(load(), version)
+                _snapshots[name] = snapshot
+    return snapshot.response(request)
+
+
+async def acatalogue_response(request, name, load):
+    """catalogue_response() с асинхронной функцией load.
+
+    Снимок заменяется без блокировки: при гонке он будет построен
+    дважды, но воркер не ждёт на блокировке в цикле событий.
+    """
+    version = await aget_catalogue_version(name)
+    snapshot = _snapshots.get(name)
+    if snapshot is None or snapshot.version != version:
+        snapshot = CatalogueSnapshot(await load(), version)
+        _snapshots[name] = snapshot
+    return snapshot.response(request)
@@ -0,0 +1,103 @@
+import csv
+import json
+
+from rest_framework.exceptions import NotFound
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingListExporter(BaseRenderer):
+    """Базовый экспортёр списка покупок.
+
+    Оформлен как рендерер DRF, чтобы формат выбирался параметром
+    ?format=. Сам список отдаётся построчно через stream(), render()
+    нужен только для ответов с ошибками.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, rows):
+        raise NotImplementedError
+
+    @staticmethod
+    def item(row):
+        return (
+            row['ingredient__name'],
+            row['amount'],
+            row['ingredient__measurement_unit'],
+        )
+
+
+class TxtExporter(ShoppingListExporter):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield 'Список покупок: \n'
+        separator = ''
+        for row in rows:
+            name, amount, measurement_unit = self.item(row)
+            yield f'{separator} • {name} {amount} {measurement_unit}'
+            separator = '\n'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+class CsvExporter(ShoppingListExporter):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        )
+        for row in rows:
+            yield writer.writerow(self.item(row))
+
+
+class JsonExporter(ShoppingListExporter):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, rows):
+        yield '['
+        separator = ''
+        for row in rows:
+            name, amount, measurement_unit = self.item(row)
+            yield separator + json.dumps(
+                {
+                    'name': name,
+                    'amount': amount,
+                    'measurement_unit': measurement_unit,
+                },
+                ensure_ascii=False
+            )
+            separator = ','
+        yield ']'
+
+
+EXPORTERS = (TxtExporter, CsvExporter, JsonExporter)
+
+
+class ExportFormatNegotiation(DefaultContentNegotiation):
+    """Выбирает экспортёр только по ?format=, по умолчанию — первый."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        export_format = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        )
+        if not export_format:
+            return renderers[0], renderers[0].media_type
+        for renderer in renderers:
+            if renderer.format == export_format:
+                return renderer, renderer.media_type
+        raise NotFound(f'Формат {export_format} не поддерживается.')
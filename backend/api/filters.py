@@ -1,17 +1,141 @@
+from operator import eq, ge, gt, le, lt
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import (Case, Count, F, IntegerField, OuterRef, Q,
+                              Subquery, Value, When)
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+
+from recipes.models import (Ingredient, IngredientPostings, Recipe,
+                            RecipeIngredient, Tag)
+
+from .pagination import LimitPageNumberPagination
+
 
-from recipes.models import Ingredient, Recipe, Tag
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
 
 
 class IngredientFilter(FilterSet):
     name = filters.CharFilter(lookup_expr='startswith')
+    name_prefix = filters.CharFilter(
+        field_name='name',
+        lookup_expr='istartswith'
+    )
+    name_contains = filters.CharFilter(
+        field_name='name',
+        lookup_expr='icontains'
+    )
 
     class Meta:
         model = Ingredient
-        fields = ('name',)
+        fields = ('name', 'name_prefix', 'name_contains')
+
+
+def ingredients_total():
+    """Число ингредиентов рецепта OuterRef('pk') — подзапрос."""
+    return Subquery(
+        RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            total=Count('*')
+        ).values('total'),
+        output_field=IntegerField()
+    )
+
+
+class RecipeCoverage:
+    """Рецепты с совпавшими ингредиентами, отсортированные в памяти.
+
+    Строки {'id', 'matched_ingredients', 'missing_ingredients'} идут
+    по убыванию числа совпадений, затем id. Сортировка и деление
+    на страницы не обращаются к базе: в неё уходят только id строк
+    среза, чтобы посчитать недостающие ингредиенты. Умеет то, что
+    нужно паджинаторам api.pagination: count(), срезы, order_by()
+    и filter() с условием позиции курсора.
+    """
+
+    ordering = ('-matched_ingredients', '-id')
+    operators = {'exact': eq, 'lt': lt, 'gt': gt, 'lte': le, 'gte': ge}
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def from_ingredients(cls, ingredient_ids):
+        coverage = IngredientPostings.objects.coverage(ingredient_ids)
+        return cls([
+            {'id': recipe_id, 'matched_ingredients': count}
+            for count, recipe_id in sorted(
+                ((count, recipe_id) for recipe_id, count in coverage.items()),
+                reverse=True
+            )
+        ])
+
+    def count(self):
+        return len(self.rows)
+
+    def order_by(self, *ordering):
+        if ordering == self.ordering:
+            return self
+        if ordering == tuple(name.lstrip('-') for name in self.ordering):
+            return RecipeCoverage(self.rows[::-1])
+        raise ValueError(f'Неподдерживаемая сортировка: {ordering}')
+
+    def filter(self, condition):
+        return RecipeCoverage(
+            [row for row in self.rows if self.matches(row, condition)]
+        )
+
+    @classmethod
+    def matches(cls, row, condition):
+        results = (
+            cls.matches(row, child) if isinstance(child, Q)
+            else cls.compare(row, *child)
+            for child in condition.children
+        )
+        if condition.connector == Q.AND:
+            return all(results) != condition.negated
+        return any(results) != condition.negated
+
+    @classmethod
+    def compare(cls, row, lookup, value):
+        name, _, operator = lookup.partition('__')
+        return cls.operators[operator or 'exact'](row[name], int(value))
+
+    def __getitem__(self, key):
+        rows = self.rows[key]
+        totals = dict(RecipeIngredient.objects.filter(
+            recipe_id__in=[row['id'] for row in rows]
+        ).order_by().values('recipe_id').annotate(
+            total=Count('*')
+        ).values_list('recipe_id', 'total'))
+        return [
+            {
+                **row,
+                'missing_ingredients': (
+                    (totals.get(row['id']) or 0) - row['matched_ingredients']
+                ),
+            }
+            for row in rows
+        ]
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """Сортировка ?ordering= с -id в конце для стабильных страниц."""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering:
+            return (*ordering, '-id')
+        return ordering
 
 
 class RecipeFilter(FilterSet):
+    name = filters.CharFilter(lookup_expr='icontains')
+    search = filters.CharFilter(method='filter_search')
+    ingredients = NumberInFilter(method='filter_ingredients')
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
@@ -27,7 +151,63 @@ class RecipeFilter(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author',)
+        fields = ('name', 'search', 'ingredients', 'tags', 'author',)
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию.
+
+        Запрос разбирается как в поисковиках (websearch), результаты
+        сортируются по релевантности. Курсорный режим с поиском
+        не поддерживается: ранг — float4, и позиция по нему после
+        перевода в текст и обратно не совпадает с рангом в базе.
+        """
+        if LimitPageNumberPagination.cursor_query_param in (
+            self.request.query_params
+        ):
+            raise ValidationError({
+                LimitPageNumberPagination.cursor_query_param: (
+                    'Поиск не поддерживает курсорный режим, '
+                    'используйте page.'
+                )
+            })
+        query = SearchQuery(
+            value,
+            config=Recipe.SEARCH_CONFIG,
+            search_type='websearch'
+        )
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-id')
+
+    def filter_ingredients(self, queryset, name, value):
+        """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+        Совпадения считаются по инвертированному индексу
+        IngredientPostings. Сначала идут рецепты с наибольшим числом
+        совпавших ингредиентов, при равенстве — новые. Так фильтр
+        работает вместе с другими фильтрами; без них список строится
+        по RecipeCoverage, не передавая в базу все найденные id.
+        """
+        coverage = IngredientPostings.objects.coverage(
+            int(ingredient_id) for ingredient_id in value
+        )
+        if not coverage:
+            return queryset.none()
+        recipes_by_count = {}
+        for recipe_id, count in coverage.items():
+            recipes_by_count.setdefault(count, []).append(recipe_id)
+        return queryset.filter(id__in=list(coverage)).annotate(
+            matched_ingredients=Case(
+                *(
+                    When(id__in=recipe_ids, then=Value(count))
+                    for count, recipe_ids in recipes_by_count.items()
+                ),
+                default=Value(0),
+                output_field=IntegerField()
+            ),
+        ).annotate(
+            missing_ingredients=ingredients_total() - F('matched_ingredients')
+        ).order_by(*RecipeCoverage.ordering)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
@@ -0,0 +1,111 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+from .cache import aget_catalogue_version, get_catalogue_version
+
+
+def normalize(value):
+    """Приводит строку к виду для поиска: без регистра, ё → е."""
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Ингредиенты, отсортированные по нормализованному названию.
+
+    Префиксный поиск идёт бинарным поиском по отсортированным ключам,
+    совпадения по подстроке добавляются после префиксных.
+    """
+
+    def __init__(self, ingredients, version=None):
+        # Одно название может быть с разными единицами измерения,
+        # поэтому порядок доопределяется единицей и id.
+        items = sorted(ingredients, key=lambda item: (
+            normalize(item['name']), item['name'],
+            item['measurement_unit'], item['id']
+        ))
+        self.keys = [normalize(item['name']) for item in items]
+        self.items = items
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    def search(self, query):
+        query = normalize(query)
+        start = bisect_left(self.keys, query)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(query):
+            end += 1
+        matches = self.items[start:end]
+        matches.extend(
+            item for key, item in zip(self.keys, self.items)
+            if query in key and not key.startswith(query)
+        )
+        return matches
+
+
+INDEX_FIELDS = ('id', 'name', 'measurement_unit')
+
+_index = None
+_lock = threading.Lock()
+
+
+def is_checked(index):
+    """Индекс сверялся с версией справочника недавно."""
+    return index is not None and (
+        time.monotonic() - index.checked_at
+        < settings.INGREDIENT_INDEX_CHECK_INTERVAL
+    )
+
+
+def invalidate_ingredient_index():
+    """Сбрасывает индекс воркера, следующий поиск построит его заново."""
+    global _index
+    _index = None
+
+
+def get_ingredient_index():
+    """Возвращает индекс ингредиентов воркера.
+
+    Строится при первом обращении и перестраивается, когда меняется
+    версия справочника ингредиентов (см. api.signals). Версия читается
+    из базы не чаще раза в INGREDIENT_INDEX_CHECK_INTERVAL секунд,
+    между проверками поиск к базе не обращается.
+    """
+    global _index
+    index = _index
+    if is_checked(index):
+        return index
+    version = get_catalogue_version('ingredients')
+    with _lock:
+        index = _index
+        if index is None or index.version != version:
+            index = IngredientIndex(
+                Ingredient.objects.values(*INDEX_FIELDS), version
+            )
+            _index = index
+        index.checked_at = time.monotonic()
+    return index
+
+
+async def aget_ingredient_index():
+    """get_ingredient_index() для асинхронных представлений."""
+    global _index
+    index = _index
+    if is_checked(index):
+        return index
+    version = await aget_catalogue_version('ingredients')
+    if index is None or index.version != version:
+        index = IngredientIndex(
+            [
+                item async for item
+                in Ingredient.objects.values(*INDEX_FIELDS)
+            ],
+            version
+        )
+        _index = index
+    index.checked_at = time.monotonic()
+    return index
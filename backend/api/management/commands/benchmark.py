@@ -0,0 +1,118 @@
+import threading
+import time
+from argparse import FileType
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, percent):
+    """Перцентиль отсортированного списка (ближайший ранг)."""
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагружает запущенный сервер одновременными запросами '
+        'и выводит пропускную способность и задержки. Для сравнения '
+        'режимов запустите его против одного и того же набора данных '
+        'с SERVER_MODE=wsgi и SERVER_MODE=asgi. С --method POST '
+        'и --data замеряется создание объектов, например рецептов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls',
+            nargs='+',
+            help='Адреса, которые запрашиваются по кругу.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Количество одновременных соединений.'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=1000,
+            help='Общее количество запросов.'
+        )
+        parser.add_argument(
+            '--method',
+            default='GET',
+            choices=('GET', 'POST'),
+            help='HTTP-метод запросов.'
+        )
+        parser.add_argument(
+            '--data',
+            type=FileType('rb'),
+            help='Файл с JSON-телом запроса для --method POST.'
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен для заголовка Authorization.'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='Таймаут одного запроса в секундах.'
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        total = options['requests']
+        if concurrency < 1 or total < 1:
+            raise CommandError(
+                '--concurrency и --requests должны быть больше 0.'
+            )
+        headers = {}
+        body = None
+        if options['data']:
+            body = options['data'].read()
+            headers['Content-Type'] = 'application/json'
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        urls = options['urls']
+        # У каждого потока своя сессия: соединение держится открытым,
+        # как у браузера, и сервер видит concurrency соединений.
+        local = threading.local()
+
+        def fetch(number):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+                session.headers.update(headers)
+            started = time.perf_counter()
+            try:
+                status = session.request(
+                    options['method'], urls[number % len(urls)],
+                    data=body, timeout=options['timeout']
+                ).status_code
+            except requests.RequestException as error:
+                status = type(error).__name__
+            return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(fetch, range(total)))
+        elapsed = time.perf_counter() - started
+
+        statuses = Counter(status for status, _ in results)
+        latencies = sorted(latency * 1000 for _, latency in results)
+        self.stdout.write(
+            f'Запросов: {total}, соединений: {concurrency}, '
+            f'время: {elapsed:.2f} с, {total / elapsed:.1f} запросов/с.'
+        )
+        self.stdout.write(
+            f'Задержка, мс: p50 {percentile(latencies, 50):.1f}, '
+            f'p95 {percentile(latencies, 95):.1f}, '
+            f'p99 {percentile(latencies, 99):.1f}, '
+            f'макс. {latencies[-1]:.1f}.'
+        )
+        self.stdout.write('Ответы: ' + ', '.join(
+            f'{status}: {count}' for status, count in statuses.most_common()
+        ))
@@ -1,8 +1,184 @@
-from rest_framework.pagination import PageNumberPagination
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage, Page
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, PageNumberPagination,
+                                       _reverse_ordering)
+
+
+class LimitCursorPagination(CursorPagination):
+    """Курсорный паджинатор без подсчёта COUNT(*).
+
+    Сортирует по ?ordering=, если у представления есть OrderingFilter
+    и параметр задан, иначе — по сортировке queryset (например,
+    по числу совпавших ингредиентов) или модели. Последовательности
+    не из базы (Timeline, RecipeCoverage) задают её атрибутом ordering.
+
+    CursorPagination из DRF ищет позицию только по первому полю
+    сортировки, а повторы значений пропускает через OFFSET (не больше
+    offset_cutoff). Здесь позиция — значения всех полей сортировки,
+    последнее из которых уникально (например, -favorites_count, -id),
+    и страница ищется по составному ключу: по индексу с теми же полями
+    это поиск без OFFSET на любой глубине.
+    """
+
+    page_size_query_param = "limit"
+    page_size = 6
+    position_separator = ','
+
+    def get_ordering(self, request, queryset, view):
+        for backend in getattr(view, 'filter_backends', ()):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return tuple(ordering)
+        if not isinstance(queryset, QuerySet):
+            return queryset.ordering
+        return (
+            tuple(queryset.query.order_by) or queryset.model._meta.ordering
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        ordering = self.ordering
+        if reverse:
+            ordering = _reverse_ordering(ordering)
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            try:
+                # Значения позиции приводятся к типам полей здесь же.
+                queryset = queryset.filter(
+                    self.get_seek_filter(ordering, current_position)
+                )
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # Лишняя строка показывает, есть ли следующая страница.
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_seek_filter(self, ordering, position):
+        """Строки после позиции в порядке ordering.
+
+        Для (-a, -id) и позиции (x, y): a <= x AND (a < x OR id < y).
+        Граница по первому полю отдельным условием даёт базе начать
+        просмотр индекса сразу с позиции.
+        """
+        values = position.split(self.position_separator)
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        names = [order.lstrip('-') for order in ordering]
+        lookups = ['lt' if order.startswith('-') else 'gt'
+                   for order in ordering]
+        seek = Q()
+        for index in range(len(ordering)):
+            seek |= Q(**{
+                **dict(zip(names[:index], values[:index])),
+                f'{names[index]}__{lookups[index]}': values[index],
+            })
+        return Q(**{f'{names[0]}__{lookups[0][0]}te': values[0]}) & seek
+
+    def _get_position_from_instance(self, instance, ordering):
+        return self.position_separator.join(
+            str(instance[name] if isinstance(instance, dict)
+                else getattr(instance, name))
+            for name in (order.lstrip('-') for order in ordering)
+        )
 
 
 class LimitPageNumberPagination(PageNumberPagination):
-    """Паджинатор с параметром limit."""
+    """Паджинатор с параметром limit.
+
+    По умолчанию работает постранично (page/limit). Если в запросе есть
+    параметр cursor (для первой страницы — пустой), переключается
+    на курсорный режим LimitCursorPagination.
+    """
 
     page_size_query_param = "limit"
     page_size = 6
+    cursor_query_param = "cursor"
+    cursor_pagination_class = LimitCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() для асинхронных представлений.
+
+        COUNT(*) и страница читаются асинхронным ORM. Курсорный режим
+        использует синхронный CursorPagination и выполняется в потоке.
+        """
+        self.cursor_paginator = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return await sync_to_async(
+                self.cursor_paginator.paginate_queryset
+            )(queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # count — cached_property, заполняем его заранее, чтобы
+        # Paginator не делал синхронный запрос.
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        bottom = (number - 1) * paginator.per_page
+        top = bottom + paginator.per_page
+        if top + paginator.orphans >= paginator.count:
+            top = paginator.count
+        self.page = Page(
+            [item async for item in queryset[bottom:top]], number, paginator
+        )
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
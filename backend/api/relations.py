@@ -0,0 +1,126 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+from recipes.models import DataVersion, Favorite, ShoppingCart
+from users.models import Follow
+
+from .utils import TTLCache, bump_version, get_version
+
+# Начиная с этого размера id хранятся в отсортированном array('q'):
+# 8 байт на id вместо десятков байт на int в frozenset.
+COMPACT_THRESHOLD = 1000
+
+_worker_cache = TTLCache(
+    maxsize=settings.USER_RELATIONS_CACHE_SIZE,
+    ttl=settings.USER_RELATIONS_TTL
+)
+
+
+class IdSet:
+    """Неизменяемое множество id с проверкой вхождения за O(1)/O(log n)."""
+
+    __slots__ = ('_ids', '_compact')
+
+    def __init__(self, ids):
+        ids = list(ids)
+        self._compact = len(ids) >= COMPACT_THRESHOLD
+        if self._compact:
+            self._ids = array('q', sorted(ids))
+        else:
+            self._ids = frozenset(ids)
+
+    def __contains__(self, value):
+        if not self._compact:
+            return value in self._ids
+        index = bisect_left(self._ids, value)
+        return index < len(self._ids) and self._ids[index] == value
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class UserRelations:
+    """Id избранного, корзины и подписок пользователя.
+
+    Каждый набор загружается одним запросом values_list
+    при первом обращении.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    @cached_property
+    def favorites(self):
+        return IdSet(Favorite.objects.filter(
+            user_id=self.user_id
+        ).order_by('recipe_id').values_list('recipe_id', flat=True))
+
+    @cached_property
+    def shopping_cart(self):
+        return IdSet(ShoppingCart.objects.filter(
+            user_id=self.user_id
+        ).order_by('recipe_id').values_list('recipe_id', flat=True))
+
+    @cached_property
+    def following(self):
+        return IdSet(Follow.objects.filter(
+            user_id=self.user_id
+        ).order_by('following_id').values_list('following_id', flat=True))
+
+
+def get_user_relations(request):
+    """Возвращает UserRelations текущего пользователя или None для гостя.
+
+    Наборы живут в течение запроса, а при USER_RELATIONS_TTL > 0 ещё
+    и в памяти воркера. Тогда они хранятся по версии связей: после
+    изменения в любом воркере наборы загружаются заново.
+    """
+    if request is None or request.user.is_anonymous:
+        return None
+    relations = getattr(request, '_user_relations', None)
+    if relations is None:
+        user_id = request.user.id
+        if settings.USER_RELATIONS_TTL > 0:
+            key = (user_id, get_relations_version(user_id))
+            relations = _worker_cache.get(key)
+            if relations is None:
+                relations = UserRelations(user_id)
+                _worker_cache.set(key, relations)
+        else:
+            relations = UserRelations(user_id)
+        request._user_relations = relations
+    return relations
+
+
+def relations_version_key(user_id):
+    return f'relations:{user_id}:version'
+
+
+def get_relations_version(user_id):
+    """Номер версии избранного, корзины и подписок пользователя.
+
+    Входит в ETag ответов, которые зависят от этих наборов.
+    """
+    number, _ = get_version(relations_version_key(user_id))
+    return number
+
+
+def relations_version(user_id):
+    """get_relations_version() как выражение для запроса к другой таблице."""
+    return Coalesce(
+        Subquery(DataVersion.objects.filter(
+            key=relations_version_key(user_id)
+        ).values('value')[:1]),
+        0
+    )
+
+
+def invalidate_user_relations(request):
+    """Сбрасывает наборы пользователя после изменения его связей."""
+    request._user_relations = None
+    bump_version(relations_version_key(request.user.id))
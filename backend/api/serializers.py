@@ -1,13 +1,17 @@
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+from recipes.models import (Ingredient, IngredientPostings, Recipe,
+                            RecipeIngredient, ShoppingListItem, Tag,
+                            lock_recipe)
 from users.models import Follow, User
 
+from .relations import get_user_relations
+
 
 class UserCreateSerializer(UserCreateSerializer):
     """Сериализация данных для создания пользователя."""
@@ -42,10 +46,12 @@ class UserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        relations = get_user_relations(self.context.get('request'))
+        if relations is None:
             return False
-        return obj.following.filter(user=request.user, following=obj).exists()
+        return obj.id in relations.following
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -120,17 +126,58 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    def to_representation(self, instance):
+        # Подписка на автора приходит аннотацией рецепта из
+        # RecipeViewSet.get_queryset, отдаём её вложенному UserSerializer.
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        relations = get_user_relations(self.context.get('request'))
+        if relations is None:
             return False
-        return request.user.favorites.filter(recipe=obj).exists()
+        return obj.id in relations.favorites
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        relations = get_user_relations(self.context.get('request'))
+        if relations is None:
             return False
-        return request.user.shoppingcarts.filter(recipe=obj).exists()
+        return obj.id in relations.shopping_cart
+
+
+class AuthorFragmentSerializer(UserSerializer):
+    """Автор рецепта без поля is_subscribed, зависящего от пользователя."""
+
+    is_subscribed = None
+
+    class Meta(UserSerializer.Meta):
+        fields = tuple(
+            field for field in UserSerializer.Meta.fields
+            if field != 'is_subscribed'
+        )
+
+
+class RecipeFragmentSerializer(RecipeListSerializer):
+    """Общая для всех пользователей часть RecipeListSerializer.
+
+    Используется для кэша рецептов, персональные поля добавляются
+    к ней при каждом запросе.
+    """
+
+    author = AuthorFragmentSerializer(read_only=True)
+    is_favorited = None
+    is_in_shopping_cart = None
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = tuple(
+            field for field in RecipeListSerializer.Meta.fields
+            if field not in ('is_favorited', 'is_in_shopping_cart')
+        )
 
 
 class CreateRecipeIngredientSerializer(serializers.ModelSerializer):
@@ -175,31 +222,40 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise ValidationError('Нужен хотя бы 1 ингредиент')
         if not tags:
             raise ValidationError('Нужен хотя бы 1 тег')
-        ingredients = []
+        ingredient_ids = []
         for item in ingredients_data:
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
             if int(item['amount']) <= 0:
                 raise ValidationError(
                     'Количество ингредиента не может быть меньше 1!')
-            ingredients.append(ingredient)
-        if len(ingredients) > len(set(ingredients)):
+            ingredient_ids.append(item['id'])
+        if len(ingredient_ids) > len(set(ingredient_ids)):
             raise ValidationError('Ингредиенты не могут повторяться!')
+        missing = set(ingredient_ids) - set(
+            Ingredient.objects.filter(
+                id__in=ingredient_ids
+            ).values_list('id', flat=True)
+        )
+        if missing:
+            raise ValidationError({
+                'ingredients': 'Ингредиенты не найдены: '
+                + ', '.join(str(pk) for pk in sorted(missing))
+            })
         if len(tags) > len(set(tags)):
             raise ValidationError('Теги не могут повторяться!')
         return data
 
     def ingredient_amount(self, recipe, ingredients):
+        # id ингредиентов уже проверены одним запросом в validate().
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
-                ingredient=get_object_or_404(
-                    Ingredient,
-                    id=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 recipe=recipe,
                 amount=ingredient['amount']
             )
             for ingredient in ingredients
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -207,19 +263,73 @@ class RecipeSerializer(serializers.ModelSerializer):
             **validated_data)
         recipe.tags.set(tags)
         self.ingredient_amount(recipe, ingredients)
+        IngredientPostings.objects.add(
+            recipe.id, [ingredient['id'] for ingredient in ingredients]
+        )
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только добавленные, изменённые и удалённые ингредиенты."""
+        # Под блокировкой рецепта ингредиенты читаются заново, а не из
+        # prefetch: иначе разница могла бы считаться от старых данных.
+        lock_recipe(recipe.id)
+        current = {
+            item.ingredient_id: item
+            for item in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        removed = current.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe,
+                ingredient_id__in=removed
+            ).delete()
+        changed = []
+        deltas = {
+            ingredient_id: -current[ingredient_id].amount
+            for ingredient_id in removed
+        }
+        for ingredient_id, amount in amounts.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                deltas[ingredient_id] = amount
+            elif item.amount != amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                changed.append(item)
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        self.ingredient_amount(recipe, [
+            item for item in ingredients if item['id'] not in current
+        ])
+        IngredientPostings.objects.change(
+            recipe.id,
+            added=amounts.keys() - current.keys(),
+            removed=removed
+        )
+        ShoppingListItem.objects.apply_recipe_change(recipe.id, deltas)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        instance.tags.clear()
+        # set() сам вычисляет разницу с текущими тегами.
         instance.tags.set(tags)
-        instance.ingredients.clear()
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        self.ingredient_amount(instance, ingredients)
+        self.update_ingredients(instance, ingredients)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        # Сбрасываем кэш связей, заполненный до записи ингредиентов,
+        # и загружаем их вместе с ингредиентами одним запросом.
+        getattr(instance, '_prefetched_objects_cache', {}).pop(
+            'recipe_ingredients', None
+        )
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
         return RecipeListSerializer(instance,
                                     context=self.context).data
 
@@ -289,32 +399,29 @@ class FollowListSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        user = request.user
-        if user.is_anonymous:
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        relations = get_user_relations(self.context.get('request'))
+        if relations is None:
             return False
-        return obj.following.filter(user=user, following=obj).exists()
+        return obj.id in relations.following
 
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('recipes_limit')
-        if recipes_limit:
-            recipes_limit = int(recipes_limit)
-        recipes = obj.recipes.all()[:recipes_limit]
+        # preview_recipes заполняется в FollowViewSet.subscriptions
+        # одним запросом на всю страницу.
+        if hasattr(obj, 'preview_recipes'):
+            recipes = obj.preview_recipes
+        else:
+            recipes = obj.recipes.all()[:self.context.get('recipes_limit')]
         return RecipeShortSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Favorite
-        fields = ('user', 'recipe')
-
-
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class SubscriptionsParamsSerializer(serializers.Serializer):
+    """Параметры запроса для списка подписок."""
 
-    class Meta:
-        model = ShoppingCart
-        fields = ('user', 'recipe')
+    recipes_limit = serializers.IntegerField(min_value=1, required=False)
@@ -0,0 +1,143 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.db.models import F
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (DataVersion, Ingredient, IngredientPostings,
+                            Recipe, RecipeIngredient, ShoppingListItem, Tag,
+                            TimelineEntry, lock_recipe)
+from users.models import Follow, User
+
+from .authentication import invalidate_tokens
+from .cache import bump_catalogue_version, touch_recipes
+from .ingredient_index import invalidate_ingredient_index
+from .utils import bump_version
+
+AUTHOR_FIELDS = frozenset(('email', 'username', 'first_name', 'last_name'))
+
+
+def recipes_changed(recipe_ids):
+    """Обновляет updated_at рецептов, по которому они ищутся в кэше,
+    и версию списков рецептов."""
+    touch_recipes(recipe_ids)
+    bump_version(DataVersion.RECIPES)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    bump_version(DataVersion.RECIPES)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        TimelineEntry.objects.fan_out(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    # Корзины удалятся каскадно, поэтому списки покупок
+    # уменьшаем заранее.
+    lock_recipe(instance.pk)
+    amounts = RecipeIngredient.amounts(instance.pk)
+    ShoppingListItem.objects.apply_recipe_change(
+        instance.pk, amounts, sign=-1
+    )
+    IngredientPostings.objects.remove(instance.pk, amounts.keys())
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    recipes_changed([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes_changed([instance.pk])
+    elif pk_set:
+        recipes_changed(pk_set)
+    else:
+        recipes_changed(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def tag_changed(sender, instance, created, **kwargs):
+    bump_catalogue_version('tags')
+    if not created:
+        recipes_changed(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    bump_catalogue_version('tags')
+    recipes_changed(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    bump_catalogue_version('ingredients')
+    transaction.on_commit(invalidate_ingredient_index)
+    if not created:
+        recipes_changed(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    bump_catalogue_version('ingredients')
+    transaction.on_commit(invalidate_ingredient_index)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields and not AUTHOR_FIELDS & update_fields):
+        return
+    recipes_changed(instance.recipes.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Избранное и корзины удалятся каскадно, минуя CartManager,
+    # поэтому счётчики рецептов уменьшаем заранее.
+    Recipe.objects.filter(favorites__user=instance).update(
+        favorites_count=F('favorites_count') - 1
+    )
+    Recipe.objects.filter(shoppingcarts__user=instance).update(
+        in_carts_count=F('in_carts_count') - 1
+    )
+    bump_version(DataVersion.RECIPE_COUNTERS)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        TimelineEntry.objects.backfill(
+            instance.user_id, instance.following_id
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    TimelineEntry.objects.remove(instance.user_id, instance.following_id)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    # В кэше токенов лежит сам пользователь, поэтому сбрасываем его
+    # при любом изменении, кроме обновления last_login при входе.
+    if created or (update_fields and update_fields <= {'last_login'}):
+        return
+    invalidate_tokens(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
@@ -0,0 +1,1075 @@
+import csv
+import re
+from base64 import b64decode, b64encode
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from foodgram.db_pool.base import BlockingConnectionPool
+from recipes.models import (DataVersion, Favorite, Ingredient,
+                            IngredientPostings, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingListItem, Tag,
+                            TimelineEntry)
+from users.models import Follow, User
+
+from .async_views import AsyncReadView
+from .authentication import REVOKED, invalidate_tokens, token_cache_key
+from .cache import (RECIPE_CACHE_VERSION, catalogue_version_key,
+                    recipe_cache_key)
+from .ingredient_index import IngredientIndex, invalidate_ingredient_index
+from .relations import relations_version_key
+from .urls import async_urlpatterns
+from .urls import urlpatterns as api_urlpatterns
+
+
+class IngredientIndexTests(SimpleTestCase):
+    """Поиск ингредиентов по индексу в памяти."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(f'{settings.BASE_DIR}/ingredients.csv',
+                  encoding='utf-8') as file:
+            cls.ingredients = [
+                {'id': number, 'name': name, 'measurement_unit': unit}
+                for number, (name, unit)
+                in enumerate((row for row in csv.reader(file) if row), 1)
+            ]
+        cls.index = IngredientIndex(cls.ingredients)
+
+    def test_builds_from_catalogue(self):
+        self.assertEqual(len(self.index.items), len(self.ingredients))
+        self.assertEqual(self.index.keys, sorted(self.index.keys))
+
+    def test_same_name_with_different_units(self):
+        for name in ('пекарский порошок', 'стейк семги'):
+            with self.subTest(name=name):
+                matches = self.index.search(name)
+                self.assertEqual(len(matches), 2)
+                self.assertEqual(
+                    [item['measurement_unit'] for item in matches],
+                    sorted(item['measurement_unit'] for item in matches)
+                )
+
+    def test_prefix_matches_first(self):
+        matches = self.index.search('Сок')
+        self.assertTrue(matches)
+        prefix = [
+            item for item in matches
+            if item['name'].casefold().startswith('сок')
+        ]
+        self.assertEqual(matches[:len(prefix)], prefix)
+        self.assertTrue(all('сок' in item['name'].casefold()
+                            for item in matches))
+
+    def test_yo_matches_ye(self):
+        matches = self.index.search('ерш')
+        self.assertIn('ёрш-носарь', [item['name'] for item in matches])
+        self.assertEqual(self.index.search('Ёрш'), matches)
+
+
+class IngredientSearchTests(TestCase):
+    """Поиск по названию отвечает из индекса воркера без запросов."""
+
+    def setUp(self):
+        invalidate_ingredient_index()
+        self.addCleanup(invalidate_ingredient_index)
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def search(self, name):
+        return [
+            item['name'] for item
+            in self.client.get(f'/api/ingredients/?name={name}').json()
+        ]
+
+    def test_warm_lookup_makes_no_queries(self):
+        self.assertEqual(self.search('со'), ['Соль'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('сол'), ['Соль'])
+
+    def test_change_in_this_worker_is_visible_at_once(self):
+        self.search('со')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Сода', measurement_unit='г')
+        self.assertEqual(self.search('со'), ['Сода', 'Соль'])
+
+    def test_change_from_another_worker_is_visible_after_check(self):
+        self.search('со')
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Сода', measurement_unit='г')]
+        )
+        DataVersion.objects.bump([catalogue_version_key('ingredients')])
+        self.assertEqual(self.search('со'), ['Соль'])
+        with override_settings(INGREDIENT_INDEX_CHECK_INTERVAL=0):
+            self.assertEqual(self.search('со'), ['Сода', 'Соль'])
+
+
+class CatalogueVersionTests(TestCase):
+    """Снимки справочников сверяются с версией из базы."""
+
+    def test_change_from_another_process_is_visible(self):
+        first = self.client.get('/api/tags/')
+        self.assertEqual(first.json(), [])
+        # bulk_create не отправляет сигналов: так справочник меняет,
+        # например, loaddata в отдельном процессе.
+        Tag.objects.bulk_create([Tag(name='Завтрак', slug='breakfast')])
+        DataVersion.objects.bump([catalogue_version_key('tags')])
+        second = self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual([tag['slug'] for tag in second.json()],
+                         ['breakfast'])
+        self.assertIn('Last-Modified', second)
+        self.assertEqual(self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=second['ETag']
+        ).status_code, 304)
+
+
+class RelationsVersionTests(TestCase):
+    """Персональные флаги и ETag следуют версии связей из базы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@foodgram.ru', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Борщ', text='Свекла',
+            image='recipe_images/borsch.png', cooking_time=60
+        )
+
+    def setUp(self):
+        token = Token.objects.create(user=self.user)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def change_in_another_worker(self):
+        # Другой воркер меняет избранное и версию, не трогая память
+        # этого процесса.
+        Favorite.objects.add(self.user, self.recipe.id)
+        DataVersion.objects.bump([relations_version_key(self.user.id)])
+
+    def test_detail_etag_changes_with_relations(self):
+        first = self.client.get(self.url)
+        self.assertFalse(first.json()['is_favorited'])
+        self.change_in_another_worker()
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertTrue(second.json()['is_favorited'])
+
+    @override_settings(USER_RELATIONS_TTL=60)
+    def test_worker_relations_follow_version(self):
+        self.assertFalse(self.client.get(self.url).json()['is_favorited'])
+        self.change_in_another_worker()
+        self.assertTrue(self.client.get(self.url).json()['is_favorited'])
+
+
+class ConditionalListTests(TestCase):
+    """ETag списка рецептов строится из версий данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='author@foodgram.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Борщ', text='Свекла',
+            image='recipe_images/borsch.png', cooking_time=60
+        )
+
+    def get(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified_in_one_query(self):
+        etag = self.client.get('/api/recipes/?limit=100')['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.get('/api/recipes/?limit=100', etag).status_code, 304
+            )
+        self.assertEqual(self.get('/api/recipes/?limit=6', etag).status_code,
+                         200)
+
+    def test_counters_only_change_popularity_ordering(self):
+        plain = self.client.get('/api/recipes/')['ETag']
+        popular_url = '/api/recipes/?ordering=-favorites_count'
+        popular = self.client.get(popular_url)['ETag']
+        Favorite.objects.add(self.user, self.recipe.id)
+        DataVersion.objects.bump([DataVersion.RECIPE_COUNTERS])
+        self.assertEqual(self.get('/api/recipes/', plain).status_code, 304)
+        self.assertEqual(self.get(popular_url, popular).status_code, 200)
+
+    def test_recipe_change_changes_etag(self):
+        etag = self.client.get('/api/recipes/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=self.user, name='Щи', text='Капуста',
+                image='recipe_images/shchi.png', cooking_time=40
+            )
+        response = self.get('/api/recipes/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+
+class RecipeFragmentCacheTests(TestCase):
+    """Общие части рецептов хранятся в кэше по id и updated_at."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='author@foodgram.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Борщ', text='Свекла',
+            image='recipe_images/borsch.png', cooking_time=60
+        )
+
+    def test_late_write_of_old_fragment_is_not_served(self):
+        self.client.get('/api/recipes/')
+        old_key = recipe_cache_key(self.recipe.id, self.recipe.updated_at)
+        stale = cache.get(old_key, version=RECIPE_CACHE_VERSION)
+        self.assertEqual(stale['name'], 'Борщ')
+        self.recipe.name = 'Щи'
+        self.recipe.save()
+        # Читатель, загрузивший рецепт до изменения, записывает его
+        # в кэш уже после фиксации.
+        cache.set(old_key, stale, version=RECIPE_CACHE_VERSION)
+        results = self.client.get('/api/recipes/').json()['results']
+        self.assertEqual(results[0]['name'], 'Щи')
+
+    def test_author_change_refreshes_fragment(self):
+        self.client.get('/api/recipes/')
+        self.user.first_name = 'Новое'
+        self.user.save()
+        results = self.client.get('/api/recipes/').json()['results']
+        self.assertEqual(results[0]['author']['first_name'], 'Новое')
+
+
+@override_settings(TOKEN_CACHE_ALIAS='default')
+class TokenCacheTests(TestCase):
+    """Общий кэш токенов — единственный источник для всех воркеров."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@foodgram.ru', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+
+    def test_logout_rejects_token_at_once(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.client.get('/api/users/me/').status_code, 200
+            )
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_cached_token_adds_no_queries(self):
+        self.client.get('/api/tags/')
+        with CaptureQueriesContext(connection) as anonymous:
+            Client().get('/api/tags/')
+        with CaptureQueriesContext(connection) as authenticated:
+            self.client.get('/api/tags/')
+        self.assertEqual(len(authenticated), len(anonymous))
+
+    def test_shared_cache_has_no_password_hash(self):
+        self.client.get('/api/users/me/')
+        cached = cache.get(token_cache_key(self.token.key))
+        self.assertNotIn('password', cached['user'])
+        self.assertNotIn(self.user.password, repr(cached))
+        self.assertNotIn(self.token.key, repr(cached))
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.json()['username'], self.user.username)
+
+    def test_deactivation_rejects_token(self):
+        self.client.get('/api/users/me/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_late_reader_does_not_restore_revoked_token(self):
+        # Запрос прочитал токен из базы до отзыва, а записывает
+        # результат уже после него.
+        credentials = TokenAuthentication().authenticate_credentials(
+            self.token.key
+        )
+        invalidate_tokens([self.token.key])
+        cache.add(token_cache_key(self.token.key), credentials)
+        self.assertEqual(cache.get(token_cache_key(self.token.key)), REVOKED)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertEqual(cache.get(token_cache_key(self.token.key)), REVOKED)
+
+
+class CursorOrderingTests(TestCase):
+    """Курсор по составному ключу при сортировке по популярности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='author@foodgram.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.user, name=f'Рецепт {number}', text='Текст',
+                image='recipe_images/recipe.png', cooking_time=10,
+                favorites_count=number % 2
+            )
+            for number in range(11)
+        )
+        cls.expected = list(Recipe.objects.order_by(
+            '-favorites_count', '-id'
+        ).values_list('id', flat=True))
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('o=', self.decode(url))
+            ids.append([recipe['id'] for recipe in data['results']])
+            url = data[link]
+        return ids
+
+    @staticmethod
+    def decode(url):
+        cursor = parse_qs(urlsplit(url).query).get('cursor', [''])[0]
+        return b64decode(cursor).decode()
+
+    def test_pages_follow_counter_and_id(self):
+        pages = self.walk(
+            '/api/recipes/?ordering=-favorites_count&limit=2&cursor=',
+            'next'
+        )
+        self.assertEqual(sum(pages, []), self.expected)
+        last = self.client.get(
+            '/api/recipes/?ordering=-favorites_count&limit=2&cursor='
+        ).json()
+        while last['next']:
+            last = self.client.get(last['next']).json()
+        backwards = self.walk(last['previous'], 'previous')
+        self.assertEqual(sum(reversed(backwards), []), self.expected[:-1])
+
+    def test_invalid_position_is_not_found(self):
+        cursor = b64encode(b'p=x').decode()
+        response = self.client.get(
+            f'/api/recipes/?ordering=-favorites_count&cursor={cursor}'
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class FeedTests(TestCase):
+    """Лента читается по TimelineEntry с рецептами больших авторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author, cls.large, cls.other = (
+            User.objects.create_user(
+                email=f'{name}@foodgram.ru', username=name,
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for name in ('reader', 'author', 'large', 'other')
+        )
+        Follow.objects.create(user=cls.reader, following=cls.author)
+        Follow.objects.create(user=cls.reader, following=cls.large)
+        Follow.objects.create(user=cls.other, following=cls.large)
+        for number in range(7):
+            Recipe.objects.create(
+                author=(cls.author, cls.large, cls.other)[number % 3],
+                name=f'Рецепт {number}', text='Текст',
+                image='recipe_images/recipe.png', cooking_time=10
+            )
+        cls.expected = list(Recipe.objects.exclude(
+            author=cls.other
+        ).values_list('id', flat=True))
+
+    def setUp(self):
+        token = Token.objects.create(user=self.reader)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+
+    def pages(self, url, link='next'):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids += [recipe['id'] for recipe in data['results']]
+            url = data[link]
+        return ids
+
+    def test_large_authors_are_merged_into_timeline(self):
+        self.assertFalse(TimelineEntry.objects.filter(
+            recipe__author=self.large
+        ).exists())
+        self.assertEqual(self.pages('/api/recipes/feed/?limit=2'),
+                         self.expected)
+        self.assertEqual(
+            self.pages('/api/recipes/feed/?limit=2&cursor='), self.expected
+        )
+        self.assertEqual(
+            self.client.get('/api/recipes/feed/').json()['count'],
+            len(self.expected)
+        )
+
+    def test_cursor_goes_back(self):
+        data = self.client.get('/api/recipes/feed/?limit=2&cursor=').json()
+        while data['next']:
+            data = self.client.get(data['next']).json()
+        ids = self.pages(data['previous'], 'previous')
+        self.assertEqual(sorted(ids, reverse=True), self.expected[:-1])
+
+
+class IngredientCoverageTests(TestCase):
+    """Подбор по ингредиентам сортируется и делится на страницы в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='author@foodgram.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(4)
+        )
+        cls.uses = {}
+        for number in range(9):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Текст',
+                image='recipe_images/recipe.png', cooking_time=10
+            )
+            used = cls.ingredients[number % 3:number % 3 + 2]
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in used
+            )
+            cls.uses[recipe.id] = used
+        IngredientPostings.objects.rebuild()
+        cls.wanted = cls.ingredients[:2]
+        cls.query = ','.join(str(item.id) for item in cls.wanted)
+
+    def expected(self):
+        matched = {
+            recipe_id: len(set(used) & set(self.wanted))
+            for recipe_id, used in self.uses.items()
+        }
+        return [
+            (recipe_id, count, len(self.uses[recipe_id]) - count)
+            for recipe_id, count in sorted(
+                matched.items(), key=lambda item: (item[1], item[0]),
+                reverse=True
+            ) if count
+        ]
+
+    def pages(self, url):
+        rows = []
+        while url:
+            data = self.client.get(url).json()
+            rows += [
+                (recipe['id'], recipe['matched_ingredients'],
+                 recipe['missing_ingredients'])
+                for recipe in data['results']
+            ]
+            url = data['next']
+        return rows
+
+    def test_pages_in_both_modes(self):
+        url = f'/api/recipes/?ingredients={self.query}&limit=2'
+        self.assertEqual(self.pages(url), self.expected())
+        self.assertEqual(self.pages(f'{url}&cursor='), self.expected())
+
+    def test_only_page_ids_reach_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(
+                f'/api/recipes/?ingredients={self.query}&limit=2'
+            ).json()
+        self.assertEqual(data['count'], len(self.expected()))
+        # В IN-списках не больше id, чем строк на странице.
+        for query in queries.captured_queries:
+            for values in re.findall(r'IN \(([^)]*)\)', query['sql']):
+                self.assertLessEqual(len(values.split(',')), 2)
+
+    def test_combines_with_other_filters(self):
+        recipe_id = self.expected()[-1][0]
+        other = User.objects.create_user(
+            email='other@foodgram.ru', username='other',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        Recipe.objects.exclude(id=recipe_id).update(author=other)
+        data = self.client.get(
+            f'/api/recipes/?ingredients={self.query}&author={self.user.id}'
+        ).json()
+        self.assertEqual(
+            [(recipe['id'], recipe['matched_ingredients'],
+              recipe['missing_ingredients']) for recipe in data['results']],
+            self.expected()[-1:]
+        )
+
+    def test_change_locks_postings_once(self):
+        recipe_id = next(iter(self.uses))
+        added, removed = self.ingredients[3], self.uses[recipe_id][0]
+        with CaptureQueriesContext(connection) as queries:
+            IngredientPostings.objects.change(
+                recipe_id, added=[added.id], removed=[removed.id]
+            )
+        self.assertEqual(sum(
+            'FOR UPDATE' in query['sql'] for query in queries.captured_queries
+        ), 1)
+        postings = dict(IngredientPostings.objects.values_list(
+            'ingredient_id', 'recipe_ids'
+        ))
+        self.assertIn(recipe_id, postings[added.id])
+        self.assertNotIn(recipe_id, postings[removed.id])
+
+    def test_change_keeps_postings_sorted(self):
+        ingredient = self.ingredients[0]
+        recipe_ids = sorted(
+            recipe_id for recipe_id, used in self.uses.items()
+            if ingredient in used
+        )
+        middle = recipe_ids[len(recipe_ids) // 2]
+        manager = IngredientPostings.objects
+        manager.change(middle, removed=[ingredient.id])
+        manager.change(middle, added=[ingredient.id])
+        manager.change(recipe_ids[-1] + 100, added=[ingredient.id])
+        self.assertEqual(
+            manager.get(ingredient=ingredient).recipe_ids,
+            recipe_ids + [recipe_ids[-1] + 100]
+        )
+
+
+class QueryCountTests(TestCase):
+    """Число запросов списка и рецепта не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='author@foodgram.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(2)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3)
+        )
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Текст',
+                image='recipe_images/recipe.png', cooking_time=10
+            )
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in ingredients
+            )
+        cls.recipe = recipe
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def authenticate(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+
+    def assert_queries(self, url, number):
+        cache.clear()
+        with self.assertNumQueries(number):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def assert_list_queries(self, cold, warm):
+        # Пустой кэш: версии, COUNT, страница и три запроса общих частей
+        # рецептов. С кэшем общих частей остаются первые три.
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                url = f'/api/recipes/?limit={limit}'
+                self.assert_queries(url, cold)
+                with self.assertNumQueries(warm):
+                    self.client.get(url)
+
+    def test_list_anonymous(self):
+        self.assert_list_queries(cold=6, warm=3)
+
+    def test_list_authenticated(self):
+        # Плюс чтение токена.
+        self.authenticate()
+        self.assert_list_queries(cold=7, warm=4)
+
+    def test_detail_anonymous(self):
+        # Версия рецепта, рецепт с автором, теги, ингредиенты.
+        self.assert_queries(f'/api/recipes/{self.recipe.id}/', 4)
+
+    def test_detail_authenticated(self):
+        self.authenticate()
+        self.assert_queries(f'/api/recipes/{self.recipe.id}/', 5)
+
+
+class ConcurrentCartTests(TransactionTestCase):
+    """Одновременные добавления и удаления одной пары (user, recipe)."""
+
+    threads = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@foodgram.ru', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Борщ', text='Свекла',
+            image='recipe_images/borsch.png', cooking_time=60
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def run_at_once(self, method):
+        barrier = Barrier(self.threads)
+        url = f'/api/recipes/{self.recipe.id}/favorite/'
+
+        def request():
+            client = Client(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+            try:
+                barrier.wait()
+                return getattr(client, method)(url).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            futures = [
+                executor.submit(request) for _ in range(self.threads)
+            ]
+            return sorted(future.result() for future in futures)
+
+    def test_one_add_and_one_remove_succeed(self):
+        self.assertEqual(self.run_at_once('post'),
+                         [201] + [400] * (self.threads - 1))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(Favorite.objects.count(), 1)
+
+        self.assertEqual(self.run_at_once('delete'),
+                         [204] + [400] * (self.threads - 1))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertFalse(Favorite.objects.exists())
+
+
+class ConcurrentShoppingListTests(TransactionTestCase):
+    """Корзины и правка ингредиентов рецепта одновременно."""
+
+    buyers = 6
+    rounds = 4
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            email='author@foodgram.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        self.tag = Tag.objects.create(name='Обед', slug='lunch')
+        self.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(2)
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Борщ', text='Свекла',
+            image='recipe_images/borsch.png', cooking_time=60
+        )
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredients[0], amount=1
+        )
+        self.tokens = [
+            Token.objects.create(user=User.objects.create_user(
+                email=f'buyer{number}@foodgram.ru',
+                username=f'buyer{number}', first_name='Имя',
+                last_name='Фамилия', password='password'
+            )).key
+            for number in range(self.buyers)
+        ] + [Token.objects.create(user=self.author).key]
+
+    def edit_body(self, amount):
+        return {
+            'name': 'Борщ', 'text': 'Свекла', 'cooking_time': 60,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': amount},
+                {'id': self.ingredients[1].id, 'amount': amount * 2},
+            ][:1 + amount % 2],
+        }
+
+    def run_at_once(self, cart_method, amount):
+        barrier = Barrier(len(self.tokens))
+        cart_url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+
+        def request(key):
+            client = Client(HTTP_AUTHORIZATION=f'Token {key}')
+            try:
+                barrier.wait()
+                if key != self.tokens[-1]:
+                    return getattr(client, cart_method)(cart_url).status_code
+                return client.patch(
+                    f'/api/recipes/{self.recipe.id}/',
+                    self.edit_body(amount),
+                    content_type='application/json'
+                ).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(len(self.tokens)) as executor:
+            return sorted(executor.map(request, self.tokens))
+
+    def test_shopping_lists_match_carts(self):
+        # Каждая правка меняет количества, а чётная ещё и убирает
+        # второй ингредиент.
+        amount = 1
+        for number in range(self.rounds):
+            for method, status in (('post', 201), ('delete', 204)):
+                amount += 1
+                with self.subTest(round=number, method=method):
+                    self.assertEqual(
+                        self.run_at_once(method, amount),
+                        sorted([200] + [status] * self.buyers)
+                    )
+                    self.assertEqual(
+                        {
+                            (item.user_id, item.ingredient_id): item.amount
+                            for item in ShoppingListItem.objects.all()
+                        },
+                        ShoppingListItem.objects.calculate()
+                    )
+
+
+class ReadOnlyAdminTests(TestCase):
+    """Модели с производными данными в админке только просматриваются."""
+
+    models = (Favorite, RecipeIngredient, ShoppingCart, ShoppingListItem)
+
+    def test_cannot_add_change_or_delete(self):
+        superuser = User.objects.create_superuser(
+            email='admin@foodgram.ru', username='admin',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        self.client.force_login(superuser)
+        for model in self.models:
+            with self.subTest(model=model.__name__):
+                url = f'/admin/recipes/{model._meta.model_name}/'
+                self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertEqual(
+                    self.client.get(f'{url}add/').status_code, 403
+                )
+                model_admin = admin.site._registry[model]
+                request = RequestFactory().get(url)
+                request.user = superuser
+                self.assertFalse(model_admin.has_change_permission(request))
+                self.assertFalse(model_admin.has_delete_permission(request))
+
+
+class UserListQueryCountTests(TestCase):
+    """Флаг is_subscribed страницы пользователей — одним Exists()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create(
+            User(
+                email=f'user{number}@foodgram.ru', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(100)
+        )
+        cls.reader = cls.users[0]
+        Follow.objects.bulk_create(
+            Follow(user=cls.reader, following=user)
+            for user in cls.users[1::2]
+        )
+        cls.token = Token.objects.create(user=cls.reader)
+
+    def test_page_of_100_users(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+        # Токен, COUNT и страница с is_subscribed.
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/users/?limit=100')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        followed = {user.id for user in self.users[1::2]}
+        self.assertEqual(len(results), 100)
+        for user in results:
+            self.assertEqual(user['is_subscribed'], user['id'] in followed)
+
+
+class SubscriptionsOrderingTests(TestCase):
+    """Подписки идут по username, как пользователи в User.Meta."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            email='reader@foodgram.ru', username='reader',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        for username in ('zz', 'alpha', 'mid'):
+            author = User.objects.create(
+                email=f'{username}@foodgram.ru', username=username,
+                first_name='Имя', last_name='Фамилия'
+            )
+            Follow.objects.create(user=cls.reader, following=author)
+        cls.token = Token.objects.create(user=cls.reader)
+
+    def usernames(self, url):
+        names = []
+        while url:
+            data = self.client.get(url).json()
+            names += [user['username'] for user in data['results']]
+            url = data['next']
+        return names
+
+    def test_ordered_by_username_in_both_modes(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+        url = '/api/users/subscriptions/?limit=2'
+        self.assertEqual(self.usernames(url), ['alpha', 'mid', 'zz'])
+        self.assertEqual(
+            self.usernames(f'{url}&cursor='), ['alpha', 'mid', 'zz']
+        )
+
+
+class IngredientNameIndexTests(TestCase):
+    """Поиск ингредиентов по названию использует индексы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Соль {number}', measurement_unit='г')
+            for number in range(50)
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            # Таблица маленькая: без этого планировщик выберет seq scan.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    @staticmethod
+    def index_exists(name):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_indexes WHERE indexname = %s', (name,)
+            )
+            return cursor.fetchone() is not None
+
+    def assert_uses_index(self, queryset, index):
+        if not self.index_exists(index):
+            self.skipTest(f'Индекса {index} нет в базе.')
+        self.assertIn(index, queryset.explain())
+
+    def test_prefix_uses_upper_index(self):
+        self.assert_uses_index(
+            Ingredient.objects.filter(name__istartswith='сол'),
+            'ingredient_name_upper_idx'
+        )
+
+    def test_contains_uses_trigram_index(self):
+        # pg_trgm есть не во всех сборках PostgreSQL.
+        self.assert_uses_index(
+            Ingredient.objects.filter(name__icontains='оль'),
+            'ingredient_name_trgm_idx'
+        )
+
+
+class RecipeSearchTests(TestCase):
+    """Полнотекстовый поиск сортирует по релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='author@foodgram.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        # Совпадение в названии весит больше, хотя рецепт старше.
+        cls.in_name = Recipe.objects.create(
+            author=cls.user, name='Свекла печёная', text='Запечь',
+            image='recipe_images/beet.png', cooking_time=40
+        )
+        cls.in_text = Recipe.objects.create(
+            author=cls.user, name='Суп', text='Свекла и капуста',
+            image='recipe_images/soup.png', cooking_time=30
+        )
+
+    def test_ordered_by_rank(self):
+        results = self.client.get('/api/recipes/?search=свекла').json()
+        self.assertEqual([recipe['id'] for recipe in results['results']],
+                         [self.in_name.id, self.in_text.id])
+
+    def test_cursor_is_rejected(self):
+        response = self.client.get('/api/recipes/?search=свекла&cursor=')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+
+
+class AsgiUrlconf:
+    """Маршруты SERVER_MODE=asgi: api.urls выбирает их при импорте."""
+
+    urlpatterns = [
+        path('api/', include(async_urlpatterns + api_urlpatterns)),
+    ]
+
+
+class AsyncReadViewTests(TestCase):
+    """Асинхронные представления отвечают так же, как вьюсеты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader = (
+            User.objects.create_user(
+                email=f'{name}@foodgram.ru', username=name,
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for name in ('author', 'reader')
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(2)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3)
+        )
+        # bulk_create не меняет версии справочников, а снимки воркера
+        # переживают откат транзакции теста.
+        DataVersion.objects.bump([
+            catalogue_version_key('tags'),
+            catalogue_version_key('ingredients')
+        ])
+        for number in range(4):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                image='recipe_images/recipe.png', cooking_time=10
+            )
+            recipe.tags.set(tags[:number % 2 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in ingredients
+            )
+        cls.recipe = recipe
+        Favorite.objects.add(cls.reader, recipe.id)
+        ShoppingCart.objects.add(cls.reader, recipe.id)
+        Follow.objects.create(user=cls.reader, following=cls.author)
+        cls.token = Token.objects.create(user=cls.reader)
+
+    def setUp(self):
+        cache.clear()
+        invalidate_ingredient_index()
+        self.addCleanup(invalidate_ingredient_index)
+
+    @staticmethod
+    def headers(token):
+        return {'Authorization': f'Token {token}'} if token else {}
+
+    async def async_get(self, url, token=None):
+        with self.settings(SERVER_MODE='asgi', ROOT_URLCONF=AsgiUrlconf):
+            response = await self.async_client.get(
+                url, headers=self.headers(token)
+            )
+            self.assertTrue(issubclass(
+                response.resolver_match.func.view_class, AsyncReadView
+            ))
+        return response
+
+    async def sync_get(self, url, token=None):
+        return await sync_to_async(self.client.get)(
+            url, headers=self.headers(token)
+        )
+
+    async def assert_same(self, url, token=None):
+        expected = await self.sync_get(url, token)
+        response = await self.async_get(url, token)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), expected.json())
+        return response
+
+    async def test_bodies_match_sync_views(self):
+        urls = (
+            '/api/recipes/',
+            '/api/recipes/?limit=2&page=2',
+            '/api/recipes/?tags=tag1',
+            f'/api/recipes/?author={self.author.id}&is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+            f'/api/recipes/{self.recipe.id}/',
+            '/api/recipes/0/',
+            '/api/tags/',
+            '/api/ingredients/',
+            '/api/ingredients/?name=ингр',
+        )
+        for token in (None, self.token.key):
+            for url in urls:
+                with self.subTest(url=url, token=bool(token)):
+                    await self.assert_same(url, token)
+
+    async def test_subscriptions_match_sync_view(self):
+        for url in ('/api/users/subscriptions/',
+                    '/api/users/subscriptions/?recipes_limit=1&limit=1'):
+            with self.subTest(url=url):
+                response = await self.assert_same(url, self.token.key)
+                self.assertEqual(response.status_code, 200)
+
+    async def test_invalid_token_is_rejected(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.id}/',
+                    '/api/tags/', '/api/ingredients/',
+                    '/api/users/subscriptions/'):
+            with self.subTest(url=url):
+                response = await self.assert_same(url, 'invalid')
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    async def test_subscriptions_require_token(self):
+        response = await self.assert_same('/api/users/subscriptions/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    async def test_revoked_token_is_rejected(self):
+        url = '/api/users/subscriptions/'
+        self.assertEqual(
+            (await self.async_get(url, self.token.key)).status_code, 200
+        )
+        await self.token.adelete()
+        self.assertEqual(
+            (await self.async_get(url, self.token.key)).status_code, 401
+        )
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Пул не закрывает возвращённые соединения сверх min_size."""
+
+    databases = {'default'}
+
+    def test_keeps_returned_connections(self):
+        pool = BlockingConnectionPool(
+            1, 3, 1, **connection.get_connection_params()
+        )
+        self.addCleanup(pool.closeall)
+        taken = [pool.getconn() for _ in range(3)]
+        for conn in taken:
+            pool.putconn(conn)
+        self.assertFalse(any(conn.closed for conn in taken))
+        self.assertIn(pool.getconn(), taken)
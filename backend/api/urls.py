@@ -1,6 +1,8 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import include, path, re_path
 from rest_framework import routers
 
+from . import async_views
 from .views import FollowViewSet, IngredientViewSet, RecipeViewSet, TagViewSet
 
 router_v1 = routers.DefaultRouter()
@@ -14,3 +16,25 @@ urlpatterns = [
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+# GET обслуживают асинхронные представления, остальные методы —
+# те же представления роутера, что и под WSGI.
+sync_views = {url.name: url.callback for url in router_v1.urls}
+async_urlpatterns = [
+    path('recipes/', async_views.RecipeListView.as_view(
+        sync_view=sync_views['recipes-list'])),
+    re_path(
+        r'^recipes/(?P<pk>\d+)/$',
+        async_views.RecipeDetailView.as_view(
+            sync_view=sync_views['recipes-detail'])
+    ),
+    path('tags/', async_views.TagListView.as_view(
+        sync_view=sync_views['tags-list'])),
+    path('ingredients/', async_views.IngredientListView.as_view(
+        sync_view=sync_views['ingredients-list'])),
+    path('users/subscriptions/', async_views.SubscriptionsView.as_view(
+        sync_view=sync_views['users-subscriptions'])),
+]
+
+if settings.SERVER_MODE == 'asgi':
+    urlpatterns = async_urlpatterns + urlpatterns
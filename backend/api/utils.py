@@ -1,9 +1,68 @@
-def create_txt(request):
-    shopping_list = 'Список покупок: \n'
-    shopping_list += '\n'.join([
-        f' • {ingredient["ingredient__name"]} '
-        f'{ingredient["amount"]} '
-        f'{ingredient["ingredient__measurement_unit"]}'
-        for ingredient in request
-    ])
-    return shopping_list
+import threading
+import time
+from collections import OrderedDict
+
+from recipes.models import DataVersion
+
+
+class TTLCache:
+    """Ограниченный по размеру LRU-кэш с временем жизни записей.
+
+    Живёт в памяти процесса, безопасен для потоков одного воркера.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+def get_versions(*keys):
+    """Версии данных по ключам: {ключ: (номер, время изменения)}.
+
+    Читаются из базы одним запросом, поэтому все воркеры видят
+    изменение сразу после фиксации транзакции, в которой оно сделано.
+    """
+    return DataVersion.objects.get_many(keys)
+
+
+def get_version(key):
+    return get_versions(key)[key]
+
+
+async def aget_versions(*keys):
+    """get_versions() для асинхронных представлений."""
+    return await DataVersion.objects.aget_many(keys)
+
+
+async def aget_version(key):
+    return (await aget_versions(key))[key]
+
+
+def bump_version(key):
+    """Отмечает изменение данных после фиксации транзакции."""
+    DataVersion.objects.bump_on_commit((key,))
@@ -1,7 +1,12 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from functools import partial
+
+from django.db.models import (Count, Exists, IntegerField, OuterRef,
+                              Prefetch, Subquery, Value)
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import translate_validation
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -9,18 +14,38 @@ from rest_framework.permissions import AllowAny, IsAuthenticated, SAFE_METHODS
 from rest_framework.response import Response
 
 from api.permissions import IsAuthorOrReadOnly
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+from recipes.models import (DataVersion, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Tag,
+                            TimelineEntry)
 from users.models import Follow, User
 
-from .utils import create_txt
-from .filters import IngredientFilter, RecipeFilter
+from .cache import get_recipe_fragments
+from .conditional import (catalogue_response, conditional_response,
+                          make_etag)
+from .exporters import EXPORTERS, ExportFormatNegotiation
+from .filters import (IngredientFilter, RecipeCoverage, RecipeFilter,
+                      RecipeOrderingFilter)
+from .ingredient_index import get_ingredient_index
 from .pagination import LimitPageNumberPagination
-from .serializers import (FavoriteSerializer, FollowListSerializer,
-                          FollowSerializer, IngredientSerializer,
-                          RecipeListSerializer, RecipeSerializer,
-                          RecipeShortSerializer, ShoppingCartSerializer,
-                          TagSerializer)
+from .relations import (invalidate_user_relations, relations_version,
+                        relations_version_key)
+from .serializers import (FollowListSerializer, FollowSerializer,
+                          IngredientSerializer, RecipeListSerializer,
+                          RecipeSerializer, RecipeShortSerializer,
+                          SubscriptionsParamsSerializer, TagSerializer)
+from .utils import get_versions
+
+
+PERSONAL_FLAGS = (
+    'is_favorited',
+    'is_in_shopping_cart',
+    'author_is_subscribed',
+)
+# Добавляются в ответ списка, только если задан фильтр ?ingredients=.
+COVERAGE_FIELDS = (
+    'matched_ingredients',
+    'missing_ingredients',
+)
 
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
@@ -32,6 +57,20 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        # Поиск по названию обслуживается индексом в памяти без обращения
+        # к базе: сначала совпадения по началу названия, затем по подстроке.
+        name = request.query_params.get('name')
+        if name is not None:
+            return Response(get_ingredient_index().search(name))
+        if any(param in request.query_params
+               for param in IngredientFilter.base_filters):
+            return super().list(request, *args, **kwargs)
+        return catalogue_response(
+            request, 'ingredients',
+            lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     """ Вьюсет для класса Tag."""
@@ -40,15 +79,245 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        return catalogue_response(
+            request, 'tags',
+            lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """ Вьюсет для класса Recipe."""
 
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        )
+    )
     pagination_class = LimitPageNumberPagination
     permission_classes = (IsAuthorOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('favorites_count', 'in_carts_count')
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        return self.annotate_user_flags(super().get_queryset())
+
+    def annotate_user_flags(self, queryset):
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Follow.objects.filter(
+                user=user, following=OuterRef('author'))),
+        )
+
+    def list(self, request, *args, **kwargs):
+        coverage = self.get_coverage()
+        if coverage is not None:
+            return self.get_conditional_sequence_response(coverage)
+        return self.get_conditional_list_response(
+            self.filter_queryset(Recipe.objects.all())
+        )
+
+    def get_coverage(self):
+        """RecipeCoverage, если из фильтров задан только ?ingredients=.
+
+        Иначе None: подбор по ингредиентам вместе с другими фильтрами
+        выполняет RecipeFilter запросом к базе.
+        """
+        if self.has_list_filters(ignore=('ingredients',)):
+            return None
+        filterset = self.filterset_class(
+            self.request.query_params, queryset=Recipe.objects.none(),
+            request=self.request
+        )
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        ingredient_ids = filterset.form.cleaned_data.get('ingredients')
+        if not ingredient_ids:
+            return None
+        return RecipeCoverage.from_ingredients(ingredient_ids)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_field]
+        state = self.get_detail_state(pk).first()
+        render = partial(super().retrieve, request, *args, **kwargs)
+        if state is None:
+            return render()
+        return conditional_response(
+            request, self.get_detail_etag(pk, *state), render
+        )
+
+    def get_detail_state(self, pk):
+        """updated_at рецепта и версия связей пользователя одним запросом."""
+        user = self.request.user
+        return Recipe.objects.filter(pk=pk).values_list(
+            'updated_at',
+            Value(0) if user.is_anonymous else relations_version(user.id)
+        )
+
+    def get_detail_etag(self, pk, updated_at, relations_version):
+        user = self.request.user
+        return make_etag(
+            'recipe', pk, updated_at.isoformat(), user.id, relations_version
+        )
+
+    def get_list_version_keys(self, queryset):
+        """Ключи версий данных, от которых зависит страница списка.
+
+        Состав и порядок страницы меняются вместе с рецептами,
+        при сортировке по популярности — ещё и со счётчиками,
+        а персональные флаги и фильтры — со связями пользователя.
+        """
+        keys = [DataVersion.RECIPES]
+        if any(
+            name.lstrip('-') in self.ordering_fields
+            for name in queryset.query.order_by if isinstance(name, str)
+        ):
+            keys.append(DataVersion.RECIPE_COUNTERS)
+        if not self.request.user.is_anonymous:
+            keys.append(relations_version_key(self.request.user.id))
+        return keys
+
+    def get_list_etag(self, versions):
+        """ETag списка: параметры запроса и номера версий данных."""
+        return make_etag(
+            'recipes', self.request.path,
+            sorted(self.request.query_params.lists()),
+            self.request.user.id,
+            *(number for number, _ in versions.values())
+        )
+
+    def get_conditional_list_response(self, queryset):
+        """Список с ETag из версий данных, прочитанных одним запросом.
+
+        Сам отфильтрованный queryset до проверки ETag не выполняется:
+        если ETag совпал, страница не строится.
+        """
+        versions = get_versions(*self.get_list_version_keys(queryset))
+        return conditional_response(
+            self.request,
+            self.get_list_etag(versions),
+            lambda: self.get_list_response(self.annotate_user_flags(queryset))
+        )
+
+    def get_sequence_version_keys(self):
+        """Ключи версий для списков по Timeline и RecipeCoverage."""
+        keys = [DataVersion.RECIPES]
+        if not self.request.user.is_anonymous:
+            keys.append(relations_version_key(self.request.user.id))
+        return keys
+
+    def get_conditional_sequence_response(self, sequence):
+        """Список по последовательности id, собранной не в базе.
+
+        sequence — Timeline или RecipeCoverage: страница выбирается
+        из неё, а из базы читаются только строки страницы.
+        """
+        versions = get_versions(*self.get_sequence_version_keys())
+        return conditional_response(
+            self.request,
+            self.get_list_etag(versions),
+            lambda: self.get_sequence_response(sequence)
+        )
+
+    def get_sequence_response(self, sequence):
+        page = self.paginate_queryset(sequence)
+        page = self.merge_sequence_page(
+            page, self.get_sequence_page_values(page)
+        )
+        fragments = get_recipe_fragments(
+            {row['id']: row['updated_at'] for row in page},
+            self.get_fragment_queryset()
+        )
+        return self.get_paginated_response(
+            self.personalize_page(page, fragments)
+        )
+
+    def get_sequence_page_values(self, page):
+        return self.get_page_values(self.annotate_user_flags(
+            Recipe.objects.filter(id__in=[row['id'] for row in page])
+        ))
+
+    @staticmethod
+    def merge_sequence_page(page, values):
+        """Строки страницы в её порядке, дополненные полями из базы."""
+        rows = {row['id']: row for row in values}
+        return [
+            {**row, **rows[row['id']]} for row in page if row['id'] in rows
+        ]
+
+    def get_list_response(self, queryset):
+        """Отдаёт страницу рецептов из кэша общих частей.
+
+        Из базы читаются только id, updated_at и персональные флаги
+        страницы, остальное берётся из кэша (см. api.cache).
+        """
+        page = self.paginate_queryset(self.get_page_values(queryset))
+        fragments = get_recipe_fragments(
+            {row['id']: row['updated_at'] for row in page},
+            self.get_fragment_queryset()
+        )
+        return self.get_paginated_response(
+            self.personalize_page(page, fragments)
+        )
+
+    def get_fragment_queryset(self):
+        """Рецепты без персональных флагов — источник для кэша."""
+        return super().get_queryset()
+
+    @staticmethod
+    def get_page_values(queryset):
+        """Поля страницы, которые читаются из базы, а не из кэша.
+
+        По updated_at общая часть рецепта ищется в кэше.
+        """
+        flags = [
+            name for name in PERSONAL_FLAGS + COVERAGE_FIELDS
+            if name in queryset.query.annotations
+        ]
+        # Курсорному паджинатору нужны значения полей сортировки.
+        ordering = [
+            name.lstrip('-') for name in queryset.query.order_by
+            if isinstance(name, str)
+        ]
+        return queryset.values(
+            *dict.fromkeys(('id', 'updated_at', *flags, *ordering))
+        )
+
+    def personalize_page(self, page, fragments):
+        return [
+            self.personalize(fragments[row['id']], row) for row in page
+            if row['id'] in fragments
+        ]
+
+    def personalize(self, fragment, row):
+        author = dict(fragment['author'])
+        author['is_subscribed'] = row.get('author_is_subscribed', False)
+        data = {}
+        for field in RecipeListSerializer.Meta.fields:
+            if field == 'author':
+                data[field] = author
+            elif field == 'image':
+                data[field] = self.request.build_absolute_uri(
+                    fragment[field]
+                )
+            elif field in fragment:
+                data[field] = fragment[field]
+            else:
+                data[field] = row.get(field, False)
+        for field in COVERAGE_FIELDS:
+            if field in row:
+                data[field] = row[field]
+        return data
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -58,8 +327,34 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeListSerializer
         return RecipeSerializer
 
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь.
+
+        Без фильтров страница ленты читается по таблице TimelineEntry,
+        с фильтрами — запросом к рецептам ленты.
+        """
+        if self.has_list_filters():
+            return self.get_conditional_list_response(self.filter_queryset(
+                TimelineEntry.objects.recipes(request.user.id)
+            ))
+        return self.get_conditional_sequence_response(
+            TimelineEntry.objects.timeline(request.user.id)
+        )
+
+    def has_list_filters(self, ignore=()):
+        params = self.request.query_params
+        return any(
+            name in params and name not in ignore for name in (
+                *self.filterset_class.base_filters,
+                RecipeOrderingFilter.ordering_param,
+            )
+        )
+
     def get_permissions(self):
-        if self.request.method == 'GET':
+        if self.action in ('list', 'retrieve'):
             self.permission_classes = (AllowAny,)
         return super().get_permissions()
 
@@ -67,10 +362,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         methods=('post',),
         detail=True)
     def shopping_cart(self, request, pk):
-        return self.add_to(
-            ShoppingCart,
-            ShoppingCartSerializer,
-            request, pk)
+        return self.add_to(ShoppingCart, request, pk)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
@@ -80,29 +372,24 @@ class RecipeViewSet(viewsets.ModelViewSet):
         methods=('post',),
         detail=True)
     def favorite(self, request, pk):
-        return self.add_to(Favorite, FavoriteSerializer, request, pk)
+        return self.add_to(Favorite, request, pk)
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
         return self.delete_from(Favorite, request, pk)
 
     @staticmethod
-    def add_to(model, model_serializer, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        serializer = model_serializer(
-            data={'user': request.user.id, 'recipe': pk},
-            context={'request': request}
+    def add_to(model, request, pk):
+        if not model.objects.add(request.user, pk):
+            get_object_or_404(Recipe, id=pk)
+            return Response(
+                {'errors': 'Рецепт уже добавлен!'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        invalidate_user_relations(request)
+        serializer_model = RecipeShortSerializer(
+            get_object_or_404(Recipe, id=pk)
         )
-        serializer.is_valid(raise_exception=True)
-        if model.objects.filter(
-            user=request.user,
-            recipe=recipe
-        ).exists():
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        model.objects.create(
-            user=request.user,
-            recipe=recipe)
-        serializer_model = RecipeShortSerializer(recipe)
         return Response(
             serializer_model.data,
             status=status.HTTP_201_CREATED
@@ -110,14 +397,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @staticmethod
     def delete_from(model, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        obj = model.objects.filter(
-            user=request.user,
-            recipe=recipe
-        )
-        if obj.exists():
-            obj.delete()
+        if model.objects.remove(request.user, pk):
+            invalidate_user_relations(request)
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, id=pk)
         return Response(
             {'errors': 'Рецепт уже удален!'},
             status=status.HTTP_400_BAD_REQUEST
@@ -125,23 +408,23 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(
         detail=False,
-        permission_classes=(IsAuthenticated,))
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=EXPORTERS,
+        content_negotiation_class=ExportFormatNegotiation)
     def download_shopping_cart(self, request):
-        shopping_cart = (
-            RecipeIngredient.objects.filter(
-                recipe__shoppingcarts__user=request.user
-            ).values(
-                'ingredient__name',
-                'ingredient__measurement_unit',
-            ).order_by(
-                'ingredient__name'
-            ).annotate(amount=Sum('amount'))
-        )
-        shopping_list = create_txt(shopping_cart)
-        filename = 'shopping_list.txt'
-        response = HttpResponse(
-            shopping_list, content_type='text.txt; charset=utf-8'
+        shopping_cart = request.user.shopping_list.filter(
+            amount__gt=0
+        ).values(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount',
+        ).order_by('ingredient__name')
+        exporter = request.accepted_renderer
+        response = StreamingHttpResponse(
+            exporter.stream(shopping_cart.iterator(chunk_size=500)),
+            content_type=f'{exporter.media_type}; charset={exporter.charset}'
         )
+        filename = f'shopping_list.{exporter.format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
@@ -151,6 +434,16 @@ class FollowViewSet(UserViewSet):
 
     pagination_class = LimitPageNumberPagination
 
+    def get_queryset(self):
+        """Пользователи с флагом is_subscribed из одного Exists()."""
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(is_subscribed=Exists(
+            Follow.objects.filter(user=user, following=OuterRef('pk'))
+        ))
+
     @action(
         methods=('post',),
         detail=True)
@@ -161,10 +454,12 @@ class FollowViewSet(UserViewSet):
             'user': user.id,
             'following': following.id
         },
-            context={'request': request}
+            context={'request': request,
+                     'recipes_limit': self.get_recipes_limit(request)}
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        invalidate_user_relations(request)
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
@@ -178,16 +473,55 @@ class FollowViewSet(UserViewSet):
                                          user=user,
                                          following=following)
         subscription.delete()
+        invalidate_user_relations(request)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def get_recipes_limit(request):
+        params = SubscriptionsParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return params.validated_data.get('recipes_limit')
+
     @action(
         detail=False)
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
-        page = self.paginate_queryset(queryset)
-        recipes_limit = request.query_params['recipes_limit']
+        recipes_limit = self.get_recipes_limit(request)
+        page = self.paginate_queryset(
+            self.get_subscriptions_queryset(request.user, recipes_limit)
+        )
         serializer = FollowListSerializer(
             page, many=True,
             context={'request': request,
                      'recipes_limit': recipes_limit})
         return self.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def get_subscriptions_queryset(user, recipes_limit):
+        """Подписки пользователя с числом рецептов и их превью."""
+        # Срез в Prefetch Django выполняет одним запросом
+        # с ROW_NUMBER() OVER (PARTITION BY author_id).
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'cooking_time', 'author'
+        )[:recipes_limit]
+        return User.objects.filter(
+            following__user=user
+        ).annotate(
+            recipes_count=Coalesce(
+                Subquery(
+                    Recipe.objects.filter(
+                        author=OuterRef('pk')
+                    ).order_by().values('author').annotate(
+                        total=Count('*')
+                    ).values('total'),
+                    output_field=IntegerField()
+                ),
+                0
+            ),
+            is_subscribed=Value(True)
+        ).order_by(
+            # Порядок User.Meta, id — только для однозначной позиции
+            # курсора.
+            'username', 'id'
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='preview_recipes')
+        )
@@ -0,0 +1,161 @@
+"""PostgreSQL с пулом соединений внутри процесса.
+
+Подключается через ENGINE = 'foodgram.db_pool'. Вместо открытия
+нового соединения на каждый запрос Django берёт его из
+psycopg2.pool.ThreadedConnectionPool и возвращает обратно при
+закрытии. Размер пула задаётся в DATABASES[...]['POOL']:
+{'min_size': ..., 'max_size': ..., 'timeout': ...}. Когда все
+max_size соединений заняты, запрос ждёт освободившееся не дольше
+timeout секунд.
+
+Пул создаётся лениво и привязан к pid: после fork (gunicorn
+с preload_app) дочерний процесс создаёт свой пул, а унаследованные
+соединения родителя не использует и не закрывает.
+"""
+import os
+import threading
+
+import psycopg2.extras
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool, который ждёт свободное соединение.
+
+    Исходный пул сразу бросает PoolError, если все соединения выданы,
+    и держит свободными не больше minconn соединений: остальные
+    закрываются при возврате, и под нагрузкой запросы снова открывают
+    новые. Здесь minconn открываются при создании, а возвращённые
+    соединения хранятся, пока их не больше maxconn.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, *args, **kwargs):
+        self.timeout = timeout
+        self._available = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # _putconn сравнивает число свободных соединений с minconn.
+        self.minconn = maxconn
+
+    def getconn(self, key=None):
+        if not self._available.acquire(timeout=self.timeout):
+            raise PoolError(
+                f'Нет свободных соединений в пуле за {self.timeout} с.'
+            )
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._available.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._available.release()
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def is_actual(pool, conn_params):
+    return (
+        pool is not None
+        and pool.pid == os.getpid()
+        and pool.conn_params == conn_params
+    )
+
+
+def get_pool(alias, conn_params, pool_settings):
+    """Пул текущего процесса для alias.
+
+    Если параметры подключения изменились (например, тестовый runner
+    подменил NAME), старый пул закрывается и создаётся новый.
+    """
+    pool = _pools.get(alias)
+    if not is_actual(pool, conn_params):
+        with _lock:
+            pool = _pools.get(alias)
+            if not is_actual(pool, conn_params):
+                close_pool(alias)
+                pool = BlockingConnectionPool(
+                    pool_settings.get('min_size', 1),
+                    pool_settings['max_size'],
+                    pool_settings.get('timeout', 30),
+                    **conn_params
+                )
+                pool.pid = os.getpid()
+                pool.conn_params = conn_params
+                _pools[alias] = pool
+    return pool
+
+
+def close_pool(alias):
+    """Закрывает все соединения пула alias текущего процесса."""
+    pool = _pools.get(alias)
+    if pool is not None and pool.pid == os.getpid():
+        pool.closeall()
+    _pools.pop(alias, None)
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Соединения пула мешают удалить тестовую базу.
+        close_pool(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        pool_settings = self.settings_dict.get('POOL') or {}
+        if not pool_settings.get('max_size'):
+            raise ImproperlyConfigured(
+                "Для 'foodgram.db_pool' нужен DATABASES[...]['POOL']"
+                "['max_size']."
+            )
+        return get_pool(self.alias, conn_params, pool_settings)
+
+    def checkout(self, pool):
+        """Соединение из пула; при CONN_HEALTH_CHECKS — проверенное."""
+        connection = pool.getconn()
+        if not self.settings_dict['CONN_HEALTH_CHECKS']:
+            return connection
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+        except self.Database.Error:
+            pool.putconn(connection, close=True)
+            connection = pool.getconn()
+        return connection
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = IsolationLevel(
+            options.get('isolation_level', IsolationLevel.READ_COMMITTED)
+        )
+        self.pool = self.get_pool(conn_params)
+        connection = self.checkout(self.pool)
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.pool.pid != os.getpid():
+            # Соединение осталось от родительского процесса.
+            return
+        with self.wrap_database_errors:
+            if self.pool.closed:
+                return self.connection.close()
+            # Пул сам откатывает незавершённую транзакцию,
+            # а соединение с ошибками закрываем совсем.
+            self.pool.putconn(self.connection, close=self.errors_occurred)
@@ -0,0 +1,235 @@
+"""Замеры времени запроса: заголовок Server-Timing и строка в логе.
+
+Включается SERVER_TIMING_SAMPLE_RATE > 0 — долей запросов, которые
+измеряются. При 0 middleware отключается при запуске и ничего
+не стоит. Для каждого измеренного запроса записываются:
+
+total   — время всего запроса ниже middleware;
+view    — время представления, включая сериализацию данных;
+render  — рендеринг ответа: TemplateResponse.render() для ответов DRF
+          и блоки measure_render() в остальных представлениях;
+sql     — время и число SQL-запросов и число повторов (одинаковый
+          SQL с одинаковыми параметрами).
+
+SQL считается обёрткой execute_wrappers, которая ставится на каждое
+соединение и пишет в замер текущего запроса из ContextVar. Так
+учитываются и запросы асинхронного ORM, который выполняет их
+в других потоках. Для запросов вне выборки обёртка только читает
+ContextVar.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('foodgram.timing')
+
+_current = ContextVar('server_timing', default=None)
+
+
+class RequestTiming:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_finished = None
+        self.render_time = None
+        self.finished = None
+        self.sql_count = 0
+        self.sql_time = 0
+        self.sql_seen = set()
+        self.sql_duplicates = 0
+
+    def add_query(self, sql, params, duration):
+        self.sql_count += 1
+        self.sql_time += duration
+        key = (sql, repr(params))
+        if key in self.sql_seen:
+            self.sql_duplicates += 1
+        else:
+            self.sql_seen.add(key)
+
+    def add_render(self, duration):
+        self.render_time = (self.render_time or 0) + duration
+
+    def rendered(self, response):
+        self.add_render(time.perf_counter() - self.view_finished)
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        if self.view_started is not None and self.view_finished is None:
+            self.view_finished = self.finished
+
+    def durations(self):
+        """{метрика: миллисекунды} для измеренных частей запроса."""
+        spans = {
+            'total': (self.started, self.finished),
+            'view': (self.view_started, self.view_finished),
+        }
+        durations = {
+            name: (end - start) * 1000
+            for name, (start, end) in spans.items()
+            if start is not None and end is not None
+        }
+        if self.render_time is not None:
+            durations['render'] = self.render_time * 1000
+        durations['sql'] = self.sql_time * 1000
+        return durations
+
+    def header(self):
+        durations = self.durations()
+        metrics = [
+            f'{name};dur={duration:.1f}'
+            for name, duration in durations.items() if name != 'sql'
+        ]
+        metrics.append(
+            f'sql;dur={durations["sql"]:.1f};'
+            f'desc="queries={self.sql_count} '
+            f'duplicates={self.sql_duplicates}"'
+        )
+        return ', '.join(metrics)
+
+    def log(self, request, response):
+        durations = self.durations()
+        logger.info(
+            'event=request_timing method=%s path=%s status=%s '
+            'total_ms=%.1f view_ms=%.1f render_ms=%.1f '
+            'sql_count=%d sql_ms=%.1f sql_duplicates=%d',
+            request.method, request.path, response.status_code,
+            durations['total'], durations.get('view', 0),
+            durations.get('render', 0), self.sql_count, durations['sql'],
+            self.sql_duplicates,
+            extra={
+                'server_timing': {
+                    **durations,
+                    'sql_count': self.sql_count,
+                    'sql_duplicates': self.sql_duplicates,
+                }
+            }
+        )
+
+
+def record_query(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add_query(sql, params, time.perf_counter() - started)
+
+
+@contextmanager
+def measure_render():
+    """Учитывает время блока как render.
+
+    Для ответов, которые рендерятся внутри представления, а не
+    TemplateResponse.render(), например в api.async_views.
+    """
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add_render(time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Обёртки хранятся в DatabaseWrapper и переживают переподключение.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ServerTimingMiddleware:
+    """Измеряет долю SERVER_TIMING_SAMPLE_RATE запросов.
+
+    Ставится первым в MIDDLEWARE, чтобы total включал остальные
+    middleware. Работает и под WSGI, и под ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = settings.SERVER_TIMING_SAMPLE_RATE
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(None, connection)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Синхронные хуки Django вызывал бы под ASGI через поток.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timing, token = self.start(request)
+        if timing is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(timing, request, response)
+
+    async def __acall__(self, request):
+        timing, token = self.start(request)
+        if timing is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(timing, request, response)
+
+    def start(self, request):
+        if random.random() >= self.sample_rate:
+            request.server_timing = None
+            return None, None
+        timing = request.server_timing = RequestTiming()
+        return timing, _current.set(timing)
+
+    @staticmethod
+    def finish(timing, request, response):
+        timing.finish()
+        response['Server-Timing'] = timing.header()
+        timing.log(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = request.server_timing
+        if timing is not None:
+            timing.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Вызывается сразу после представления и перед render().
+        timing = request.server_timing
+        if timing is not None:
+            timing.view_finished = time.perf_counter()
+            response.add_post_render_callback(timing.rendered)
+        return response
+
+    async def aprocess_view(self, request, *args):
+        return ServerTimingMiddleware.process_view(self, request, *args)
+
+    async def aprocess_template_response(self, request, response):
+        return ServerTimingMiddleware.process_template_response(
+            self, request, response
+        )
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,23 +77,125 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
+
+# wsgi — синхронные воркеры gunicorn, asgi — воркеры uvicorn
+# (см. gunicorn.conf.py). В режиме asgi GET-запросы к рецептам, тегам,
+# ингредиентам и подпискам обслуживают api.async_views.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# DB_CONN_MAX_AGE — сколько секунд держать соединение между запросами
+# (0 — закрывать после каждого запроса). DB_POOL_MAX_SIZE > 0 включает
+# пул соединений в процессе (foodgram.db_pool): тогда соединение
+# возвращается в пул после каждого запроса, а DB_CONN_MAX_AGE
+# не используется. Если свободных соединений нет, запрос ждёт
+# не дольше DB_POOL_TIMEOUT секунд. Под ASGI запросы к базе выполняются
+# в разных потоках, поэтому постоянные соединения отключены —
+# используйте пул.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 0))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': (
+            'foodgram.db_pool' if DB_POOL_MAX_SIZE
+            else 'django.db.backends.postgresql'
+        ),
         'NAME': os.getenv('POSTGRES_DB', 'foodgram_db'),
         'USER': os.getenv('POSTGRES_USER', ''),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', 'db'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': (
+            0 if DB_POOL_MAX_SIZE or SERVER_MODE == 'asgi'
+            else int(os.getenv('DB_CONN_MAX_AGE', 60))
+        ),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'True').lower() == 'true'
+        ),
+        'POOL': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# При нескольких воркерах нужен общий кэш (например, Redis:
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://cache:6379/0), иначе каждый воркер держит
+# и заполняет свою копию кэша рецептов. Версии данных для ETag
+# хранятся в базе и от кэша не зависят.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 60 * 60))
+
+# Время жизни (в секундах) наборов id избранного, корзины и подписок
+# в памяти воркера. 0 — наборы живут только в пределах запроса.
+# Наборы хранятся по версии связей из базы, поэтому изменения,
+# сделанные через другие воркеры, видны сразу.
+USER_RELATIONS_TTL = int(os.getenv('USER_RELATIONS_TTL', 0))
+USER_RELATIONS_CACHE_SIZE = int(os.getenv('USER_RELATIONS_CACHE_SIZE', 10000))
+
+# Кэш аутентификации по токену: алиас общего кэша из CACHES или,
+# если он не задан, время жизни (в секундах, 0 — не кэшировать)
+# и размер кэша в памяти воркера. С общим кэшем выход, смена пароля
+# и деактивация сразу действуют во всех воркерах; с кэшем в памяти
+# другие воркеры принимают старый токен ещё до TOKEN_CACHE_TTL секунд.
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 0))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_ALIAS = os.getenv('TOKEN_CACHE_ALIAS') or None
+
+# Как часто (в секундах) индекс ингредиентов в памяти воркера сверяет
+# версию справочника с базой. Между проверками поиск по названию
+# не обращается к базе, а изменения из других воркеров видны
+# с задержкой до этого интервала; 0 — сверять на каждый запрос.
+INGREDIENT_INDEX_CHECK_INTERVAL = float(
+    os.getenv('INGREDIENT_INDEX_CHECK_INTERVAL', 5)
+)
+
+# Авторы, у которых подписчиков больше этого числа, не раскладываются
+# по лентам при создании рецепта: их рецепты добавляются при чтении.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+
+# Доля запросов (от 0 до 1), для которых в заголовок Server-Timing
+# и в лог foodgram.timing пишутся время представления, рендеринга
+# и SQL. 0 — middleware отключена.
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv('SERVER_TIMING_SAMPLE_RATE', 0))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
 DJOSER = {
     'HIDE_USERS': False,
     'LOGIN_FIELD': 'email',
@@ -156,7 +260,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
 }
@@ -0,0 +1,158 @@
+"""Настройки gunicorn, задаются переменными окружения.
+
+Запуск: gunicorn -c gunicorn.conf.py (см. Dockerfile).
+
+SERVER_MODE           wsgi (по умолчанию) или asgi — воркеры uvicorn.
+GUNICORN_BIND         адрес, по умолчанию 0.0.0.0:8000.
+GUNICORN_WORKERS      число воркеров, по умолчанию 2 * CPU + 1 для wsgi
+                      и CPU + 1 для asgi. Без общего кэша (CACHE_BACKEND
+                      не задан) — 1: каждый воркер держал бы и заполнял
+                      свою копию кэша рецептов, а отзыв токена в кэше
+                      в памяти не был бы виден другим воркерам.
+GUNICORN_THREADS      потоков на воркер wsgi. По умолчанию воркеры
+                      вместе обслуживают 2 * CPU + 1 запросов, но не
+                      меньше 2 потоков на воркер: без общего кэша весь
+                      параллелизм единственного воркера — потоки. При 1
+                      используется воркер sync. DB_POOL_MAX_SIZE должен
+                      быть не меньше числа потоков.
+GUNICORN_PRELOAD      загружать приложение в мастере до fork, True.
+GUNICORN_MAX_REQUESTS перезапуск воркера после N запросов, 1000
+                      (0 — не перезапускать); разброс — 10 %.
+GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_KEEPALIVE,
+GUNICORN_LOG_LEVEL, GUNICORN_ACCESS_LOG — как одноимённые настройки
+gunicorn.
+
+CPU считаются с учётом ограничений контейнера (cgroup, affinity).
+В лог пишутся время запуска мастера и воркеров и их память: RSS
+и PSS. При preload страницы приложения общие для воркеров, поэтому
+для оценки памяти контейнера складывайте PSS, а не RSS.
+"""
+import math
+import multiprocessing
+import os
+import resource
+import time
+
+# Файл настроек читается до загрузки приложения, в том числе до preload.
+STARTED_AT = time.monotonic()
+
+
+def cpu_count():
+    """CPU, доступные процессу, с учётом affinity и квоты cgroup."""
+    count = multiprocessing.cpu_count()
+    try:
+        count = min(count, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as file:
+            quota, period = file.read().split()
+        if quota != 'max':
+            count = min(count, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(count, 1)
+
+
+def memory_mb():
+    """RSS и PSS текущего процесса в МБ; PSS — None, если недоступен."""
+    values = {}
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            for line in file:
+                name, _, rest = line.partition(':')
+                if name in ('Rss', 'Pss'):
+                    values[name] = int(rest.split()[0]) / 1024
+    except OSError:
+        # Не Linux: только пиковый RSS текущего процесса.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        values['Rss'] = rss / 1024
+    return values.get('Rss'), values.get('Pss')
+
+
+def format_memory():
+    rss, pss = memory_mb()
+    if pss is None:
+        return f'rss_mb={rss:.1f}'
+    return f'rss_mb={rss:.1f} pss_mb={pss:.1f}'
+
+
+def env_bool(name, default):
+    return os.getenv(name, str(default)).lower() == 'true'
+
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+CPU = cpu_count()
+SHARED_CACHE = bool(os.getenv('CACHE_BACKEND'))
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    workers = int(os.getenv(
+        'GUNICORN_WORKERS', CPU + 1 if SHARED_CACHE else 1
+    ))
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    workers = int(os.getenv(
+        'GUNICORN_WORKERS', CPU * 2 + 1 if SHARED_CACHE else 1
+    ))
+    threads = int(os.getenv(
+        'GUNICORN_THREADS', max(2, math.ceil((CPU * 2 + 1) / workers))
+    ))
+    worker_class = 'gthread' if threads > 1 else 'sync'
+
+preload_app = env_bool('GUNICORN_PRELOAD', True)
+
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+# Разброс, чтобы воркеры не перезапускались одновременно.
+max_requests_jitter = max_requests // 10
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Файлы heartbeat воркеров в памяти, а не в overlay-файловой системе
+# контейнера, где запись может надолго блокироваться.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+errorlog = '-'
+accesslog = '-' if env_bool('GUNICORN_ACCESS_LOG', False) else None
+
+
+def when_ready(server):
+    if preload_app:
+        # Соединения, открытые при загрузке приложения, не должны
+        # достаться воркерам после fork.
+        from django.db import connections
+        connections.close_all()
+    server.log.info(
+        'event=master_ready mode=%s workers=%s worker_class=%s cpu=%s '
+        'preload=%s boot_s=%.2f %s',
+        SERVER_MODE, server.num_workers, server.cfg.worker_class_str, CPU,
+        preload_app, time.monotonic() - STARTED_AT, format_memory()
+    )
+
+
+def post_fork(server, worker):
+    worker.started_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    worker.log.info(
+        'event=worker_ready pid=%s boot_s=%.2f %s',
+        worker.pid, time.monotonic() - worker.started_at, format_memory()
+    )
+
+
+def worker_exit(server, worker):
+    # Воркер uvicorn не считает запросы в worker.nr.
+    requests = worker.nr if SERVER_MODE != 'asgi' else '-'
+    server.log.info(
+        'event=worker_exit pid=%s requests=%s uptime_s=%.0f %s',
+        worker.pid, requests, time.monotonic() - worker.started_at,
+        format_memory()
+    )
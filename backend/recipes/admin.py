@@ -1,11 +1,29 @@
 from django.contrib import admin
 
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+
+
+class ReadOnlyAdminMixin:
+    """Только просмотр: записи меняются через менеджеры моделей.
+
+    Менеджеры и сигналы поддерживают производные данные: счётчики
+    рецептов, списки покупок и индекс ингредиентов. Изменения
+    в админке проходили бы мимо них.
+    """
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
     list_display = ('user',
                     'recipe',)
     search_fields = ('user',
@@ -29,19 +47,16 @@ class RecipeAdmin(admin.ModelAdmin):
                     'name',
                     'image',
                     'text',
-                    'added_in_favorites',)
+                    'favorites_count',)
     search_fields = ('author',
                      'name',)
     list_filter = ('author',
                    'name',)
     empty_value_display = '-пусто-'
 
-    def added_in_favorites(self, obj):
-        return obj.favorites.count()
-
 
 @admin.register(RecipeIngredient)
-class RecipeIngredientAdmin(admin.ModelAdmin):
+class RecipeIngredientAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount',)
     search_fields = ('recipe', 'ingredient', 'amount',)
     list_filter = ('recipe', 'ingredient', 'amount',)
@@ -49,7 +64,7 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
     list_display = ('user',
                     'recipe',)
     search_fields = ('user',
@@ -59,6 +74,14 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount',)
+    search_fields = ('user__username', 'ingredient__name',)
+    list_filter = ('user',)
+    empty_value_display = '-пусто-'
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'slug',)
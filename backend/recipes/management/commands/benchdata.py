@@ -0,0 +1,218 @@
+import random
+import time
+from itertools import accumulate, islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (DataVersion, Ingredient, IngredientPostings,
+                            Recipe, RecipeIngredient, ShoppingCart)
+from users.models import Follow, User
+
+WORDS = (
+    'борщ', 'суп', 'щи', 'каша', 'салат', 'пирог', 'блины', 'рагу',
+    'плов', 'котлеты', 'запеканка', 'омлет', 'соус', 'паста', 'уха',
+    'свекла', 'капуста', 'картофель', 'морковь', 'лук', 'чеснок',
+    'говядина', 'курица', 'свинина', 'рыба', 'грибы', 'сыр', 'творог',
+    'гречка', 'рис', 'перец', 'томаты', 'тыква', 'яблоки', 'вишня',
+    'быстрый', 'домашний', 'печёный', 'тушёный', 'жареный', 'летний',
+)
+SYLLABLES = (
+    'ба', 'ве', 'ги', 'до', 'жу', 'за', 'ки', 'ло', 'му', 'не',
+    'пи', 'ро', 'са', 'ту', 'фе', 'ха', 'це', 'ча', 'ши', 'ям',
+)
+
+
+def sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт синтетических авторов и рецепты со случайными '
+        'названиями, описаниями и ингредиентами для нагрузочных '
+        'замеров (manage.py benchmark). Поисковые векторы и индекс '
+        'ингредиентов пересчитываются. Ингредиенты должны быть '
+        'загружены заранее (manage.py loaddata). С --carts и --follows '
+        'создаёт пользователей с корзинами или подписками заданных '
+        'размеров и выводит их токены.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=300000,
+            help='Количество рецептов.'
+        )
+        parser.add_argument(
+            '--authors',
+            type=int,
+            default=100,
+            help='Количество авторов.'
+        )
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=5,
+            help='Количество ингредиентов в рецепте.'
+        )
+        parser.add_argument(
+            '--carts',
+            type=sizes,
+            default=[],
+            help=(
+                'Размеры корзин через запятую, например 1,50,500: '
+                'для каждого — пользователь с токеном.'
+            )
+        )
+        parser.add_argument(
+            '--follows',
+            type=sizes,
+            default=[],
+            help=(
+                'Числа подписок на авторов через запятую, например 5,20: '
+                'для каждого — пользователь с токеном и лентой.'
+            )
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество рецептов в одном INSERT.'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Начальное значение генератора случайных чисел.'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['authors'] < 1:
+            raise CommandError(
+                '--batch-size и --authors должны быть больше 0.'
+            )
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if len(ingredient_ids) < options['ingredients']:
+            raise CommandError(
+                'Недостаточно ингредиентов, загрузите их командой loaddata.'
+            )
+        self.random = random.Random(options['seed'])
+        if options['recipes']:
+            self.create_recipes(options, ingredient_ids)
+        for size in options['carts']:
+            self.create_cart(size)
+        for size in options['follows']:
+            self.create_follower(size)
+
+    def create_recipes(self, options, ingredient_ids):
+        batch_size = options['batch_size']
+        # Частоты слов убывают как 1/ранг, как в естественных текстах:
+        # первые слова есть почти в каждом рецепте, последние — в единицах.
+        self.words = list(WORDS) + [
+            first + second + third
+            for first in SYLLABLES
+            for second in SYLLABLES
+            for third in SYLLABLES
+        ]
+        self.cum_weights = list(accumulate(
+            1 / rank for rank in range(1, len(self.words) + 1)
+        ))
+        started = time.perf_counter()
+        with transaction.atomic():
+            authors = self.create_authors(options['authors'])
+            recipes = (
+                self.make_recipe(authors) for _ in range(options['recipes'])
+            )
+            first_id = None
+            while True:
+                batch = list(islice(recipes, batch_size))
+                if not batch:
+                    break
+                created = Recipe.objects.bulk_create(batch)
+                first_id = first_id or created[0].id
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(
+                        recipe_id=recipe.id, ingredient_id=ingredient_id,
+                        amount=self.random.randint(1, 500)
+                    )
+                    for recipe in created
+                    for ingredient_id in self.random.sample(
+                        ingredient_ids, options['ingredients']
+                    )
+                )
+            if first_id is not None:
+                Recipe.update_search_vector(
+                    Recipe.objects.filter(id__gte=first_id)
+                )
+            IngredientPostings.objects.rebuild()
+            DataVersion.objects.bump_on_commit((DataVersion.RECIPES,))
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано рецептов: {options["recipes"]}, авторов: '
+            f'{len(authors)} за {time.perf_counter() - started:.1f} с.'
+        ))
+
+    def create_cart(self, size):
+        """Пользователь с size рецептами в корзине, как после API."""
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        if len(recipe_ids) < size:
+            raise CommandError(f'Рецептов меньше, чем {size}.')
+        user = self.create_user('cart', size)
+        for recipe_id in self.random.sample(recipe_ids, size):
+            ShoppingCart.objects.add(user, recipe_id)
+        token = Token.objects.create(user=user)
+        self.stdout.write(f'Корзина {size}: {user.username}, токен {token}')
+
+    def create_follower(self, size):
+        """Пользователь с size подписками и лентой, как после API."""
+        author_ids = list(
+            Recipe.objects.order_by().values_list(
+                'author_id', flat=True
+            ).distinct()
+        )
+        if len(author_ids) < size:
+            raise CommandError(f'Авторов рецептов меньше, чем {size}.')
+        user = self.create_user('feed', size)
+        # Ленту заполняет сигнал post_save подписки, как при subscribe.
+        for author_id in self.random.sample(author_ids, size):
+            Follow.objects.create(user=user, following_id=author_id)
+        token = Token.objects.create(user=user)
+        self.stdout.write(f'Подписок {size}: {user.username}, токен {token}')
+
+    def create_user(self, prefix, size):
+        number = User.objects.count()
+        return User.objects.create_user(
+            email=f'{prefix}{number}@foodgram.ru',
+            username=f'{prefix}{number}',
+            first_name='Пользователь', last_name=str(size), password=None
+        )
+
+    def create_authors(self, count):
+        start = User.objects.count()
+        return User.objects.bulk_create(
+            User(
+                email=f'bench{number}@foodgram.ru',
+                username=f'bench{number}',
+                first_name='Автор',
+                last_name=str(number),
+                password='!'
+            )
+            for number in range(start, start + count)
+        )
+
+    def make_recipe(self, authors):
+        return Recipe(
+            author=self.random.choice(authors),
+            name=self.phrase(3).capitalize(),
+            text=self.phrase(20),
+            image='recipe_images/bench.png',
+            cooking_time=self.random.randint(5, 180)
+        )
+
+    def phrase(self, words):
+        return ' '.join(self.random.choices(
+            self.words, cum_weights=self.cum_weights, k=words
+        ))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import IngredientPostings
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает или проверяет индекс рецептов по ингредиентам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить индекс с рецептами, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            count = IngredientPostings.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                f'Индекс пересобран, ингредиентов: {count}.'
+            ))
+            return
+        expected = IngredientPostings.objects.calculate()
+        actual = {
+            ingredient_id: recipe_ids
+            for ingredient_id, recipe_ids
+            in IngredientPostings.objects.values_list(
+                'ingredient_id', 'recipe_ids'
+            )
+            if recipe_ids
+        }
+        mismatched = {
+            ingredient_id for ingredient_id in expected.keys() | actual.keys()
+            if expected.get(ingredient_id) != actual.get(ingredient_id)
+        }
+        for ingredient_id in sorted(mismatched):
+            self.stdout.write(
+                f'Ингредиент {ingredient_id}: '
+                f'ожидается {expected.get(ingredient_id, [])}, '
+                f'в индексе {actual.get(ingredient_id, [])}'
+            )
+        if mismatched:
+            raise CommandError(
+                f'Расхождений: {len(mismatched)}. '
+                'Запустите команду без --verify, чтобы пересобрать индекс.'
+            )
+        self.stdout.write(self.style.SUCCESS('Индекс совпадает с рецептами.'))
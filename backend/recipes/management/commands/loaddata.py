@@ -1,23 +1,91 @@
 import csv
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.cache import bump_catalogue_version
 from recipes.models import Ingredient
 
 
 class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV (название, единица измерения). '
+        'Уже существующие ингредиенты пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=f'{settings.BASE_DIR}/ingredients.csv',
+            help='Путь к CSV-файлу.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одном INSERT.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать новые строки, ничего не записывая.'
+        )
 
     def handle(self, *args, **options):
-        with open(
-            f'{settings.BASE_DIR}/ingredients.csv',
-            'r',
-            encoding='utf-8'
-        ) as file:
-            reader = csv.reader(file)
-            for row in reader:
-                Ingredient.objects.create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
-        self.stdout.write(self.style.SUCCESS('Ингредиенты загруженны!'))
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше 0.')
+        started = time.perf_counter()
+        total = created = 0
+        try:
+            with open(options['path'], 'r', encoding='utf-8') as file, \
+                    transaction.atomic():
+                rows = (row for row in csv.reader(file) if row)
+                while True:
+                    batch = {
+                        (name, measurement_unit)
+                        for name, measurement_unit
+                        in islice(rows, batch_size)
+                    }
+                    if not batch:
+                        break
+                    total += len(batch)
+                    new = batch - self.existing(batch)
+                    created += len(new)
+                    if not options['dry_run']:
+                        Ingredient.objects.bulk_create(
+                            (
+                                Ingredient(
+                                    name=name,
+                                    measurement_unit=measurement_unit
+                                )
+                                for name, measurement_unit in new
+                            ),
+                            ignore_conflicts=True
+                        )
+                if created and not options['dry_run']:
+                    # bulk_create не отправляет сигналы post_save.
+                    bump_catalogue_version('ingredients')
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать файл: {error}')
+        except ValueError:
+            raise CommandError(
+                'Каждая строка должна содержать название '
+                'и единицу измерения.'
+            )
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        action = 'Будет загружено' if options['dry_run'] else 'Загружено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} ингредиентов: {created} из {total} '
+            f'за {elapsed:.2f} с ({total / elapsed:.0f} строк/с).'
+        ))
+
+    @staticmethod
+    def existing(batch):
+        """Возвращает пары (название, единица), которые уже есть в базе."""
+        return set(Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list('name', 'measurement_unit'))
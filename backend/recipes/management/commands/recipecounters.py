@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Favorite, ShoppingCart
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счётчики избранного и корзин рецептов с таблицами '
+        'и исправляет расхождения.'
+    )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model in (Favorite, ShoppingCart):
+            fixed = model.objects.reconcile()
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name}: '
+                f'исправлено рецептов: {fixed}.'
+            ))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает или проверяет списки покупок пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить таблицу с корзинами, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            count = ShoppingListItem.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок пересобраны, позиций: {count}.'
+            ))
+            return
+        expected = ShoppingListItem.objects.calculate()
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.filter(amount__gt=0).values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )
+        }
+        mismatched = {
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        }
+        for user_id, ingredient_id in sorted(mismatched):
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'ожидается {expected.get((user_id, ingredient_id), 0)}, '
+                f'в таблице {actual.get((user_id, ingredient_id), 0)}'
+            )
+        if mismatched:
+            raise CommandError(
+                f'Расхождений: {len(mismatched)}. '
+                'Запустите команду без --verify, чтобы пересобрать таблицу.'
+            )
+        self.stdout.write(self.style.SUCCESS('Списки покупок совпадают.'))
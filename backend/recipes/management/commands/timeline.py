@@ -0,0 +1,91 @@
+import time
+from statistics import median
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Recipe, TimelineEntry
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает ленты подписок пользователей по подпискам. '
+        'С --compare ничего не меняет, а сравнивает чтение ленты '
+        'пользователя с наивным JOIN подписок и рецептов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество записей в одном INSERT.'
+        )
+        parser.add_argument(
+            '--compare',
+            metavar='USERNAME',
+            help='Пользователь, ленту которого сравнить с JOIN.'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=6,
+            help='Размер страницы для --compare.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Количество повторов каждого замера для --compare.'
+        )
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            self.compare(options)
+            return
+        count = TimelineEntry.objects.rebuild(
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты пересобраны, записей: {count}.'
+        ))
+
+    def compare(self, options):
+        try:
+            user = User.objects.get(username=options['compare'])
+        except User.DoesNotExist:
+            raise CommandError(f'Нет пользователя {options["compare"]}.')
+        limit = options['limit']
+
+        def timeline():
+            return TimelineEntry.objects.timeline(user.id)
+
+        def join():
+            return Recipe.objects.filter(
+                author__following__user=user
+            ).order_by('-id').values_list('id', flat=True)
+
+        if [row['id'] for row in timeline()[:limit]] != list(join()[:limit]):
+            raise CommandError('Лента и JOIN вернули разные страницы.')
+        self.stdout.write(
+            f'Подписок: {user.follower.count()}, '
+            f'рецептов в ленте: {join().count()}.'
+        )
+        for name, read in (
+            ('страница', lambda sequence: list(sequence[:limit])),
+            ('count()', lambda sequence: sequence.count()),
+        ):
+            self.stdout.write(
+                f'{name}: лента {self.measure(timeline, read, options)}, '
+                f'JOIN {self.measure(join, read, options)}.'
+            )
+
+    @staticmethod
+    def measure(sequence, read, options):
+        """Медиана и минимум времени read(sequence()) в мс."""
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            read(sequence())
+            timings.append((time.perf_counter() - started) * 1000)
+        return f'{median(timings):.2f} мс (мин. {min(timings):.2f})'
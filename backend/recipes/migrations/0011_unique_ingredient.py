@@ -0,0 +1,60 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:47
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Оставляет по одному ингредиенту на пару (название, единица).
+
+    Ссылки на дубликаты переносятся на ингредиент с наименьшим id.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        keep_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1)
+    for group in groups:
+        keep_id = group['keep_id']
+        duplicates = list(Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(id=keep_id).values_list('id', flat=True))
+        for item in RecipeIngredient.objects.filter(
+            ingredient_id__in=duplicates
+        ):
+            if RecipeIngredient.objects.filter(
+                recipe_id=item.recipe_id, ingredient_id=keep_id
+            ).exists():
+                item.delete()
+            else:
+                item.ingredient_id = keep_id
+                item.save(update_fields=('ingredient',))
+        for item in ShoppingListItem.objects.filter(
+            ingredient_id__in=duplicates
+        ):
+            updated = ShoppingListItem.objects.filter(
+                user_id=item.user_id, ingredient_id=keep_id
+            ).update(amount=F('amount') + item.amount)
+            if updated:
+                item.delete()
+            else:
+                item.ingredient_id = keep_id
+                item.save(update_fields=('ingredient',))
+        Ingredient.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:50
+
+import django.contrib.postgres.fields
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_postings(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    IngredientPostings = apps.get_model('recipes', 'IngredientPostings')
+    rows = RecipeIngredient.objects.values('ingredient').annotate(
+        recipe_ids=ArrayAgg('recipe', distinct=True, ordering='recipe')
+    ).order_by()
+    IngredientPostings.objects.bulk_create(
+        (
+            IngredientPostings(
+                ingredient_id=row['ingredient'],
+                recipe_ids=row['recipe_ids']
+            )
+            for row in rows
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientPostings',
+            fields=[
+                ('ingredient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='postings', serialize=False, to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('recipe_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None, verbose_name='Id рецептов')),
+            ],
+            options={
+                'verbose_name': 'Рецепты ингредиента',
+                'verbose_name_plural': 'Индекс рецептов по ингредиентам',
+                'ordering': ('ingredient',),
+            },
+        ),
+        migrations.RunPython(fill_postings, migrations.RunPython.noop),
+    ]
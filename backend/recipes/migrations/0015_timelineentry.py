@@ -0,0 +1,60 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:56
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fill_timelines(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    large_authors = Follow.objects.values('following').annotate(
+        followers=Count('*')
+    ).filter(
+        followers__gt=settings.FEED_FANOUT_LIMIT
+    ).values('following')
+    pairs = Follow.objects.exclude(
+        following__in=large_authors
+    ).filter(
+        following__recipes__isnull=False
+    ).values_list('user_id', 'following__recipes__id')
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, recipe_id=recipe_id)
+            for user_id, recipe_id in pairs.iterator(chunk_size=1000)
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0014_recipe_counters'),
+        ('users', '0002_alter_user_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Добавлен в ленту')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Ленты подписок',
+                'ordering': ('user', '-recipe'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.6 on 2026-10-18 20:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Номер изменения')),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Изменён')),
+            ],
+            options={
+                'verbose_name': 'Версия данных',
+                'verbose_name_plural': 'Версии данных',
+            },
+        ),
+    ]
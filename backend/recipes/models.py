@@ -1,11 +1,24 @@
+from copy import copy
+from heapq import merge
+from itertools import groupby, islice
+
 from colorfield.fields import ColorField
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import (
     MaxValueValidator,
     MinValueValidator,
     RegexValidator)
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (Case, Count, F, Func, OuterRef, Q, Subquery,
+                              Sum, Value, When)
+from django.db.models.functions import Coalesce, Upper
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
 
-from users.models import User
+from users.models import Follow, User
 
 
 class Tag(models.Model):
@@ -49,6 +62,24 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        # istartswith/icontains в PostgreSQL сравнивают UPPER(name),
+        # поэтому индексы строятся по тому же выражению.
+        indexes = [
+            models.Index(
+                OpClass(Upper('name'), name='text_pattern_ops'),
+                name='ingredient_name_upper_idx'
+            ),
+            GinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='ingredient_name_trgm_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -93,15 +124,89 @@ class Recipe(models.Model):
             MaxValueValidator(3600)
         ]
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Изменён'
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В корзинах'
+    )
+
+    # Конфигурация полнотекстового поиска и поля, из которых
+    # строится search_vector (с весами для ранжирования).
+    SEARCH_CONFIG = 'russian'
+    SEARCH_FIELDS = (('name', 'A'), ('text', 'B'))
+    # Поля, которые меняются только отдельными UPDATE
+    # и не перезаписываются при обычном save().
+    DERIVED_FIELDS = ('search_vector', 'favorites_count', 'in_carts_count')
 
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            GinIndex(
+                fields=('search_vector',),
+                name='recipe_search_vector_idx'
+            ),
+            models.Index(
+                fields=('favorites_count', 'id'),
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=('in_carts_count', 'id'),
+                name='recipe_in_carts_count_idx'
+            ),
+            models.Index(
+                OpClass(Upper('name'), name='text_pattern_ops'),
+                name='recipe_name_upper_idx'
+            ),
+            GinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='recipe_name_trgm_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'name', 'text'} & set(update_fields):
+            self.update_search_vector(Recipe.objects.filter(id=self.id))
+
+    @classmethod
+    def update_search_vector(cls, queryset):
+        """Пересчитывает search_vector одним UPDATE на стороне базы."""
+        vectors = [
+            SearchVector(field, weight=weight, config=cls.SEARCH_CONFIG)
+            for field, weight in cls.SEARCH_FIELDS
+        ]
+        vector = vectors[0]
+        for other in vectors[1:]:
+            vector += other
+        return queryset.update(search_vector=vector)
+
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
@@ -142,6 +247,100 @@ class RecipeIngredient(models.Model):
             f'{self.amount} {self.ingredient.measurement_unit}'
         )
 
+    @classmethod
+    def amounts(cls, recipe_id):
+        """Возвращает {id ингредиента: количество} для рецепта."""
+        return dict(cls.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount'))
+
+
+def lock_recipe(recipe_id):
+    """Блокирует строку рецепта до конца транзакции.
+
+    Берётся перед чтением или изменением ингредиентов рецепта ради
+    списков покупок: корзины и правки рецепта переносятся в них
+    по очереди, и изменение не применяется дважды или ни разу.
+    """
+    list(Recipe.objects.select_for_update().filter(
+        pk=recipe_id
+    ).values_list('pk', flat=True))
+
+
+class CartManager(models.Manager):
+    """Менеджер для избранного и корзины с идемпотентными записями.
+
+    Вместе с записью меняет счётчик рецепта, имя которого задано
+    в атрибуте модели counter_field.
+    """
+
+    def actual_count(self):
+        """Подзапрос с реальным числом записей для рецепта OuterRef('pk')."""
+        return Coalesce(
+            Subquery(
+                self.filter(
+                    recipe=OuterRef('pk')
+                ).order_by().values('recipe').annotate(
+                    total=Count('*')
+                ).values('total')
+            ),
+            0
+        )
+
+    def reconcile(self):
+        """Исправляет расхождения счётчика, возвращает число рецептов."""
+        field = self.model.counter_field
+        fixed = Recipe.objects.annotate(
+            actual=self.actual_count()
+        ).exclude(**{field: F('actual')}).update(
+            **{field: self.actual_count()}
+        )
+        if fixed:
+            DataVersion.objects.bump_on_commit((DataVersion.RECIPE_COUNTERS,))
+        return fixed
+
+    def change_counter(self, recipe_ids, delta):
+        field = self.model.counter_field
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            **{field: F(field) + delta}
+        )
+        DataVersion.objects.bump_on_commit((DataVersion.RECIPE_COUNTERS,))
+
+    @transaction.atomic
+    def add(self, user, recipe_id):
+        """Добавляет рецепт одним INSERT ... ON CONFLICT DO NOTHING.
+
+        Возвращает True, если запись создана, и False, если она уже
+        существовала или рецепта с таким id нет.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(opts.db_table)} '
+                f'({quote(opts.get_field("user").column)}, '
+                f'{quote(opts.get_field("recipe").column)}) '
+                f'SELECT %s, {quote(Recipe._meta.pk.column)} '
+                f'FROM {quote(Recipe._meta.db_table)} '
+                f'WHERE {quote(Recipe._meta.pk.column)} = %s '
+                f'ON CONFLICT DO NOTHING '
+                f'RETURNING {quote(opts.pk.column)}',
+                (user.id, recipe_id)
+            )
+            created = cursor.fetchone() is not None
+        if created:
+            self.change_counter((recipe_id,), 1)
+        return created
+
+    @transaction.atomic
+    def remove(self, user, recipe_id):
+        """Удаляет рецепт одним DELETE, возвращает число удалённых строк."""
+        deleted, _ = self.filter(user=user, recipe_id=recipe_id).delete()
+        if deleted:
+            self.change_counter((recipe_id,), -deleted)
+        return deleted
+
 
 class Cart(models.Model):
     user = models.ForeignKey(
@@ -157,6 +356,8 @@ class Cart(models.Model):
         related_name='%(class)ss'
     )
 
+    objects = CartManager()
+
     class Meta:
         abstract = True
         default_related_name = '%(class)ss'
@@ -164,13 +365,15 @@ class Cart(models.Model):
         constraints = [
             models.UniqueConstraint(
                 fields=('user', 'recipe'),
-                name='unique_"%(class)s"_fields'
+                name='unique_%(class)s_fields'
             )
         ]
 
 
 class Favorite(Cart):
 
+    counter_field = 'favorites_count'
+
     class Meta(Cart.Meta):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -179,11 +382,624 @@ class Favorite(Cart):
         return f'{self.user} добавил {self.recipe} в Избранное'
 
 
+class ShoppingCartManager(CartManager):
+    """Менеджер корзины, поддерживающий список покупок пользователя."""
+
+    @transaction.atomic
+    def add(self, user, recipe_id):
+        # Рецепт блокируется до записи в корзину: правка его
+        # ингредиентов либо уже видит эту корзину, либо ещё не начата.
+        lock_recipe(recipe_id)
+        created = super().add(user, recipe_id)
+        if created:
+            ShoppingListItem.objects.add_amounts(
+                (user.id,), RecipeIngredient.amounts(recipe_id)
+            )
+        return created
+
+    @transaction.atomic
+    def remove(self, user, recipe_id):
+        lock_recipe(recipe_id)
+        deleted = super().remove(user, recipe_id)
+        if deleted:
+            ShoppingListItem.objects.add_amounts(
+                (user.id,), RecipeIngredient.amounts(recipe_id), sign=-1
+            )
+        return deleted
+
+
 class ShoppingCart(Cart):
 
+    counter_field = 'in_carts_count'
+    objects = ShoppingCartManager()
+
     class Meta(Cart.Meta):
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзина'
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в Корзину покупок'
+
+
+class ShoppingListManager(models.Manager):
+    """Поддержка сумм ингредиентов из корзин пользователей."""
+
+    def add_amounts(self, user_ids, amounts, sign=1):
+        """Прибавляет {id ингредиента: изменение} к спискам пользователей.
+
+        При sign=-1 количества вычитаются. Изменения применяются одним
+        UPDATE с F(); строки, сумма в которых стала нулевой, удаляются.
+        """
+        user_ids = list(user_ids)
+        amounts = {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in amounts.items() if amount
+        }
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            (
+                self.model(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids
+                for ingredient_id, amount in amounts.items() if amount > 0
+            ),
+            ignore_conflicts=True
+        )
+        self.filter(
+            user_id__in=user_ids,
+            ingredient_id__in=amounts
+        ).update(amount=F('amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(amount))
+                for ingredient_id, amount in amounts.items()
+            ),
+            default=Value(0)
+        ))
+        if any(amount < 0 for amount in amounts.values()):
+            self.filter(user_id__in=user_ids, amount__lte=0).delete()
+
+    def apply_recipe_change(self, recipe_id, amounts, sign=1):
+        """Переносит изменение ингредиентов рецепта в списки всех
+        пользователей, у которых он в корзине."""
+        self.add_amounts(
+            ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True),
+            amounts,
+            sign
+        )
+
+    def calculate(self):
+        """Считает списки покупок заново по корзинам.
+
+        Возвращает {(id пользователя, id ингредиента): количество}.
+        """
+        return {
+            (row['recipe__shoppingcarts__user'], row['ingredient']):
+                row['total']
+            for row in RecipeIngredient.objects.filter(
+                recipe__shoppingcarts__isnull=False
+            ).values(
+                'recipe__shoppingcarts__user', 'ingredient'
+            ).annotate(total=Sum('amount')).order_by()
+        }
+
+    @transaction.atomic
+    def rebuild(self, batch_size=1000):
+        """Пересобирает таблицу целиком, возвращает число строк."""
+        totals = self.calculate()
+        self.all().delete()
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for (user_id, ingredient_id), amount in totals.items()
+            ),
+            batch_size=batch_size
+        )
+        return len(totals)
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам в корзине пользователя."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items'
+    )
+    amount = models.IntegerField(
+        default=0,
+        verbose_name='Количество'
+    )
+
+    objects = ShoppingListManager()
+
+    class Meta:
+        ordering = ('user', 'ingredient')
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} {self.amount}'
+
+
+class ArrayAppend(Func):
+    function = 'array_append'
+    output_field = ArrayField(models.IntegerField())
+
+
+class ArrayInsertSorted(ArrayAppend):
+    """Вставка в отсортированный массив без повторов на стороне базы."""
+    template = (
+        'ARRAY(SELECT DISTINCT item FROM unnest(%(function)s(%(expressions)s))'
+        ' AS item ORDER BY item)'
+    )
+
+
+class ArrayRemove(Func):
+    function = 'array_remove'
+    output_field = ArrayField(models.IntegerField())
+
+
+class ArrayLast(Func):
+    """Последний элемент массива; аргумент — столбец, без параметров."""
+    template = '%(expressions)s[cardinality(%(expressions)s)]'
+    output_field = models.IntegerField()
+
+
+class IngredientPostingsManager(models.Manager):
+    """Поддержка инвертированного индекса ингредиент -> рецепты."""
+
+    def locked(self, ingredient_ids):
+        """Блокирует до конца транзакции строки индекса ингредиентов
+        и возвращает их id. Недостающие строки создаются пустыми."""
+        ingredient_ids = sorted(set(ingredient_ids))
+        self.bulk_create(
+            (
+                self.model(ingredient_id=ingredient_id)
+                for ingredient_id in ingredient_ids
+            ),
+            ignore_conflicts=True
+        )
+        # Блокируем в порядке id, чтобы параллельные записи
+        # не взаимоблокировались.
+        return list(self.select_for_update().filter(
+            ingredient_id__in=ingredient_ids
+        ).order_by('ingredient_id').values_list('ingredient_id', flat=True))
+
+    def add(self, recipe_id, ingredient_ids):
+        """Добавляет рецепт в списки переданных ингредиентов."""
+        self.change(recipe_id, added=ingredient_ids)
+
+    def remove(self, recipe_id, ingredient_ids):
+        """Убирает рецепт из списков переданных ингредиентов."""
+        self.change(recipe_id, removed=ingredient_ids)
+
+    @transaction.atomic
+    def change(self, recipe_id, added=(), removed=()):
+        """Добавляет рецепт в списки added и убирает из списков removed.
+
+        Строки обоих наборов блокируются одним запросом в порядке id:
+        отдельные блокировки для удаления и добавления при встречных
+        изменениях рецептов могли бы взаимоблокироваться. Сами списки
+        меняются в базе и не читаются в Python: их длина растёт
+        с числом рецептов.
+        """
+        added = set(added)
+        removed = set(removed) - added
+        if not added and not removed:
+            return
+        self.locked(added | removed)
+        if added:
+            # Новый рецепт обычно больше всех id в списке: тогда
+            # достаточно дописать его в конец без пересортировки.
+            self.filter(ingredient_id__in=added).update(recipe_ids=Case(
+                When(
+                    GreaterThan(Value(recipe_id), ArrayLast('recipe_ids')),
+                    then=ArrayAppend('recipe_ids', recipe_id)
+                ),
+                default=ArrayInsertSorted('recipe_ids', recipe_id)
+            ))
+        if removed:
+            self.filter(ingredient_id__in=removed).update(
+                recipe_ids=ArrayRemove('recipe_ids', recipe_id)
+            )
+
+    def coverage(self, ingredient_ids):
+        """Возвращает {id рецепта: сколько из ингредиентов он использует}.
+
+        Отсортированные списки рецептов сливаются за один проход,
+        одинаковые id идут подряд.
+        """
+        lists = self.filter(
+            ingredient_id__in=set(ingredient_ids)
+        ).order_by().values_list('recipe_ids', flat=True)
+        return {
+            recipe_id: sum(1 for _ in group)
+            for recipe_id, group in groupby(merge(*lists))
+        }
+
+    def calculate(self):
+        """Строит индекс заново по RecipeIngredient.
+
+        Возвращает {id ингредиента: отсортированный список id рецептов}.
+        """
+        postings = {}
+        for ingredient_id, recipe_id in RecipeIngredient.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id'):
+            postings.setdefault(ingredient_id, []).append(recipe_id)
+        return postings
+
+    @transaction.atomic
+    def rebuild(self, batch_size=1000):
+        """Пересобирает индекс целиком, возвращает число строк."""
+        postings = self.calculate()
+        self.all().delete()
+        self.bulk_create(
+            (
+                self.model(ingredient_id=ingredient_id, recipe_ids=recipe_ids)
+                for ingredient_id, recipe_ids in postings.items()
+            ),
+            batch_size=batch_size
+        )
+        DataVersion.objects.bump_on_commit((DataVersion.RECIPES,))
+        return len(postings)
+
+
+class IngredientPostings(models.Model):
+    """Отсортированные id рецептов, в которых есть ингредиент."""
+    ingredient = models.OneToOneField(
+        Ingredient,
+        verbose_name='Ингредиент',
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='postings'
+    )
+    recipe_ids = ArrayField(
+        models.IntegerField(),
+        default=list,
+        verbose_name='Id рецептов'
+    )
+
+    objects = IngredientPostingsManager()
+
+    class Meta:
+        ordering = ('ingredient',)
+        verbose_name = 'Рецепты ингредиента'
+        verbose_name_plural = 'Индекс рецептов по ингредиентам'
+
+    def __str__(self):
+        return f'{self.ingredient}: {len(self.recipe_ids)}'
+
+
+class Timeline:
+    """Лента пользователя: id рецептов по убыванию, как в Recipe.
+
+    Склеивает записи TimelineEntry, которые читаются по индексу
+    (user, recipe), и рецепты больших авторов, которых в таблице нет.
+    Умеет то, что нужно паджинаторам api.pagination: count(), срезы,
+    order_by() и filter() по id рецепта. Строки — {'id': id рецепта}.
+    """
+
+    ordering = Recipe._meta.ordering
+
+    def __init__(self, entries, recipes, descending=True):
+        self.entries = entries
+        self.recipes = recipes
+        self.descending = descending
+
+    def count(self):
+        return self.entries.count() + self.recipes.count()
+
+    def order_by(self, *ordering):
+        if ordering not in (('id',), ('-id',)):
+            raise ValueError(f'Лента сортируется только по id: {ordering}')
+        prefix = ordering[0][:-len('id')]
+        return Timeline(
+            self.entries.order_by(f'{prefix}recipe_id'),
+            self.recipes.order_by(f'{prefix}id'),
+            descending=bool(prefix)
+        )
+
+    def filter(self, condition):
+        """Условие на id рецепта, например позиция курсора."""
+        return Timeline(
+            self.entries.filter(self.relabel(condition, 'recipe_id')),
+            self.recipes.filter(condition),
+            self.descending
+        )
+
+    @classmethod
+    def relabel(cls, condition, field):
+        condition = copy(condition)
+        condition.children = [
+            cls.relabel(child, field) if isinstance(child, Q)
+            else (field + child[0][len('id'):], child[1])
+            for child in condition.children
+        ]
+        return condition
+
+    def __getitem__(self, key):
+        # Каждой части хватает первых stop строк: части не пересекаются.
+        ids = merge(
+            self.entries[:key.stop], self.recipes[:key.stop],
+            reverse=self.descending
+        )
+        return [
+            {'id': recipe_id}
+            for recipe_id in islice(ids, key.start, key.stop)
+        ]
+
+
+class TimelineManager(models.Manager):
+    """Лента новых рецептов от авторов, на которых подписан пользователь.
+
+    Рецепт раскладывается по лентам подписчиков при создании (fan-out
+    on write). Для авторов, у которых подписчиков больше
+    FEED_FANOUT_LIMIT, записи не создаются: их рецепты добавляются
+    в ленту при чтении.
+    """
+
+    @staticmethod
+    def followers_count():
+        return Follow.objects.filter(
+            following=OuterRef('following')
+        ).order_by().values('following').annotate(
+            total=Count('*')
+        ).values('total')
+
+    def large_authors(self, user_id=None):
+        """Id авторов, рецепты которых не раскладываются по лентам.
+
+        Если передан user_id — только среди его подписок.
+        """
+        follows = Follow.objects.all()
+        if user_id is not None:
+            follows = follows.filter(user_id=user_id)
+        return follows.annotate(
+            followers=Subquery(self.followers_count())
+        ).filter(
+            followers__gt=settings.FEED_FANOUT_LIMIT
+        ).values_list('following_id', flat=True).distinct()
+
+    def followers_to_fan_out(self, author_id):
+        """Id подписчиков автора или None, если автор слишком большой."""
+        followers = list(Follow.objects.filter(
+            following_id=author_id
+        ).values_list('user_id', flat=True)[:settings.FEED_FANOUT_LIMIT + 1])
+        if len(followers) > settings.FEED_FANOUT_LIMIT:
+            return None
+        return followers
+
+    def fan_out(self, recipe, batch_size=1000):
+        """Добавляет новый рецепт в ленты подписчиков автора."""
+        followers = self.followers_to_fan_out(recipe.author_id)
+        if followers:
+            self.bulk_create(
+                (
+                    self.model(user_id=user_id, recipe_id=recipe.id)
+                    for user_id in followers
+                ),
+                batch_size=batch_size,
+                ignore_conflicts=True
+            )
+
+    def backfill(self, user_id, author_id, batch_size=1000):
+        """Добавляет в ленту рецепты автора после подписки на него."""
+        if self.followers_to_fan_out(author_id) is None:
+            return
+        self.bulk_create(
+            (
+                self.model(user_id=user_id, recipe_id=recipe_id)
+                for recipe_id in Recipe.objects.filter(
+                    author_id=author_id
+                ).values_list('id', flat=True).iterator()
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+
+    def remove(self, user_id, author_id):
+        """Убирает из ленты рецепты автора после отписки."""
+        self.filter(user_id=user_id, recipe__author_id=author_id).delete()
+
+    def timeline(self, user_id):
+        """Лента пользователя для постраничного чтения (см. Timeline).
+
+        Рецепты больших авторов, уже попавшие в таблицу (автор вырос
+        после раскладки), берутся из таблицы.
+
+        Большие авторы читаются сразу: с подзапросом в IN база идёт
+        по рецептам в порядке id и, если таких авторов нет, проверяет
+        все рецепты, чтобы не найти ни одного.
+        """
+        large_authors = list(self.large_authors(user_id))
+        recipes = Recipe.objects.none()
+        if large_authors:
+            recipes = Recipe.objects.filter(
+                author_id__in=large_authors
+            ).exclude(timeline_entries__user_id=user_id)
+        return Timeline(
+            self.filter(user_id=user_id).order_by(
+                '-recipe_id'
+            ).values_list('recipe_id', flat=True),
+            recipes.order_by('-id').values_list('id', flat=True)
+        )
+
+    def recipes(self, user_id):
+        """Рецепты ленты: из таблицы и от больших авторов.
+
+        Для ленты с фильтрами рецептов; без фильтров лента читается
+        через timeline().
+        """
+        return Recipe.objects.filter(
+            Q(id__in=self.filter(user_id=user_id).values('recipe_id'))
+            | Q(author_id__in=self.large_authors(user_id))
+        )
+
+    @transaction.atomic
+    def rebuild(self, batch_size=1000):
+        """Пересобирает ленты целиком, возвращает число записей."""
+        self.all().delete()
+        pairs = Follow.objects.exclude(
+            following_id__in=self.large_authors()
+        ).filter(
+            following__recipes__isnull=False
+        ).values_list('user_id', 'following__recipes__id')
+        created = 0
+        batch = []
+        for user_id, recipe_id in pairs.iterator(chunk_size=batch_size):
+            batch.append(self.model(user_id=user_id, recipe_id=recipe_id))
+            if len(batch) == batch_size:
+                created += len(self.bulk_create(batch))
+                batch = []
+        created += len(self.bulk_create(batch))
+        DataVersion.objects.bump_on_commit((DataVersion.RECIPES,))
+        return created
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    created = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Добавлен в ленту'
+    )
+
+    objects = TimelineManager()
+
+    class Meta:
+        ordering = ('user', '-recipe')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_entry'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
+
+
+class DataVersionManager(models.Manager):
+    """Счётчики изменений данных для ETag и снимков в памяти воркеров.
+
+    Хранятся в базе, поэтому изменение, сделанное в одном воркере
+    или в management-команде, сразу видят все процессы.
+    """
+
+    def get_many(self, keys):
+        """{ключ: (номер изменения, время изменения)} одним запросом.
+
+        Для ключей, которые ещё не менялись, — (0, None).
+        """
+        found = {
+            key: (value, changed_at)
+            for key, value, changed_at in self.filter(
+                key__in=keys
+            ).values_list('key', 'value', 'changed_at')
+        }
+        return {key: found.get(key, (0, None)) for key in keys}
+
+    async def aget_many(self, keys):
+        found = {
+            key: (value, changed_at)
+            async for key, value, changed_at in self.filter(
+                key__in=keys
+            ).values_list('key', 'value', 'changed_at')
+        }
+        return {key: found.get(key, (0, None)) for key in keys}
+
+    def bump(self, keys):
+        """Увеличивает счётчики одним INSERT ... ON CONFLICT DO UPDATE."""
+        keys = sorted(set(keys))
+        if not keys:
+            return
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        table = quote(opts.db_table)
+        key_column, value_column, changed_column = (
+            quote(opts.get_field(name).column)
+            for name in ('key', 'value', 'changed_at')
+        )
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} '
+                f'({key_column}, {value_column}, {changed_column}) '
+                f'VALUES {", ".join(["(%s, 1, %s)"] * len(keys))} '
+                f'ON CONFLICT ({key_column}) DO UPDATE '
+                f'SET {value_column} = {table}.{value_column} + 1, '
+                f'{changed_column} = EXCLUDED.{changed_column}',
+                [param for key in keys for param in (key, now)]
+            )
+
+    def bump_on_commit(self, keys):
+        """bump() после фиксации текущей транзакции.
+
+        Так по новой версии нельзя прочитать данные до изменения.
+        """
+        keys = tuple(keys)
+        transaction.on_commit(lambda: self.bump(keys), using=self.db)
+
+
+class DataVersion(models.Model):
+    """Номер и время последнего изменения набора данных."""
+    key = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='Ключ'
+    )
+    value = models.BigIntegerField(
+        default=0,
+        verbose_name='Номер изменения'
+    )
+    changed_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Изменён'
+    )
+
+    # Рецепты и их состав; счётчики избранного и корзин отдельно,
+    # потому что от них зависит только сортировка по популярности.
+    RECIPES = 'recipes:version'
+    RECIPE_COUNTERS = 'recipes:counters:version'
+
+    objects = DataVersionManager()
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.key}: {self.value}'